@@ -1,37 +1,134 @@
-import epics, time, math, wx
+import epics, time, math, wx, threading
+import wx.lib.newevent
 import numpy as np
 from datetime import datetime
 from util import get_message_time
+from pvpool import PvPool
  
+# Events posted by AwgWriter to the window that started the write
+AwgProgressEvent, EVT_AWG_PROGRESS = wx.lib.newevent.NewEvent()
+AwgDoneEvent, EVT_AWG_DONE = wx.lib.newevent.NewEvent()
+AwgErrorEvent, EVT_AWG_ERROR = wx.lib.newevent.NewEvent()
+
+
+class WritePacer():
+    '''Adapts the wait between point writes to the measured put-completion latency. 
+        The wait shrinks towards a small margin above the latency while writes succeed, 
+        and backs off towards the configured maximum on timeouts.'''
+
+    def __init__(self, max_wait, shrink=0.7, backoff=2.0, margin=1.2, smoothing=0.3):
+        self.max_wait = max_wait
+        self.wait = max_wait
+        self.shrink = shrink
+        self.backoff = backoff
+        self.margin = margin
+        self.smoothing = smoothing
+        self.latency = None
+
+
+    def record(self, latency, ok=True):
+        if not ok:
+            self.wait = min(self.max_wait, max(self.wait, self.floor()) * self.backoff)
+            print(get_message_time()+"Write timed out, backing off: write wait now %.3f s" % self.wait)
+            return
+        # Exponentially weighted latency, so a single fast write doesn't drop the floor
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        self.wait = max(self.floor(), self.wait * self.shrink)
+
+
+    def floor(self):
+        if self.latency is None:
+            return 0
+        return min(self.max_wait, self.margin * self.latency)
+
+
 
 class  Awg():
 
-    def __init__(self, config, pulse_size, max_percent_change_allowed=5):
+    def __init__(self, config, pulse_size, max_percent_change_allowed=5, pv_factory=epics.PV):
         self.prefix = config.parms['awg_prefix'].value
         self.pulse_size = pulse_size
         self.max_incr = max_percent_change_allowed
         self.write_method = config.parms['awg_write_method'].value
         self.wait_time = config.parms['awg_wait'].value
+        self.read_timeout = config.parms['awg_read_timeout'].value
+        self.cache_time = config.parms['awg_cache_time'].value
+        self.adaptive_wait = config.parms['awg_adaptive_wait'].value
+        self.multi_step = config.parms['awg_multi_step'].value
+        self.verify = config.parms['awg_verify'].value
+        self.write_order = config.parms['awg_write_order'].value
+        self.write_budget = config.parms['awg_write_budget'].value
+        self.write_limit = config.parms['awg_write_limit'].value
+        self.deferred_writes = 0
+        self.mismatches = []
+        self.progress = None
+        self.cancel_event = threading.Event()
+        self.cancelled = False
+        self.pacer = WritePacer(self.wait_time)
         self.check_write_method()
+
+        # Shape readback is event driven: the monitor on the waveform bumps the version
+        # and wakes up anyone waiting for a new shape
+        self.shape_version = 0
+        self._written_version = -1
+        self._written_at = 0
+        self._shape_event = threading.Event()
+
+        # Connect to the per-sample setpoints and control PVs up front and keep the
+        # channels for the life of the loop
+        names = [self.prefix + ":_SetSample" + str(i) + "_do" for i in range(0, pulse_size)]
+        names += [self.prefix + suffix for suffix in
+            (':_SelScanDisable', ':ReadWaveform_ascii_do', ':ReadWaveform_ascii_do.PROC', ':DAC',
+             ':SetWaveform.PROC', ':SetWaveformBusy')]
+        if self.write_method != "pts":
+            names += [self.prefix + ":HoldSampleNorm" + str(i) for i in range(0, pulse_size)]
+        self.pvs = PvPool(pv_factory=pv_factory)
+        self.pvs.add_monitor(self.prefix + ':ReadWaveform_ascii_do', self._on_shape_update)
+        self.pvs.connect(names)
     #    self._read_current_shape()
 
-    def _read_current_shape(self):
+    def _on_shape_update(self, **kws):
+        # Called from the CA thread whenever the IOC posts a new waveform
+        self.shape_version += 1
+        self._shape_event.set()
+
+
+    def _mark_written(self):
+        # Our own write is now the best knowledge of the AWG shape, so cache it
+        self.shape_version += 1
+        self._written_version = self.shape_version
+        self._written_at = time.time()
+        self.nwf = self.wf/float(self.dac)
+
+
+    def _read_current_shape(self, use_cache=True):
+        # Serve recent reads from the shape we wrote, unless the IOC has posted since
+        if (use_cache and self._written_version == self.shape_version 
+                and time.time() - self._written_at < self.cache_time):
+            print(get_message_time()+"Using cached shape (version %d)" % self.shape_version)
+            return
+
         print(get_message_time()+"Read current shape...")
-        epics.caput(self.prefix + ':ReadWaveform_ascii_do.PROC', 1)
-        time.sleep(2)
-        self.wf = epics.caget(self.prefix + ':ReadWaveform_ascii_do')
-        self.dac = epics.caget(self.prefix + ':DAC')
+        self._shape_event.clear()
+        self.pvs.put(self.prefix + ':ReadWaveform_ascii_do.PROC', 1)
+        if not self._shape_event.wait(self.read_timeout):
+            print(get_message_time()+"Warning: no new AWG shape after %.1f s, using last value" % self.read_timeout)
+        self.wf = self.pvs.get(self.prefix + ':ReadWaveform_ascii_do')
+        self.dac = self.pvs.get(self.prefix + ':DAC')
         self.wf = np.clip(self.wf,0,self.dac)
         self.nwf = self.wf/float(self.dac)
 
 
-    def get_raw_shape(self):
-        self._read_current_shape()
+    def get_raw_shape(self, use_cache=True):
+        self._read_current_shape(use_cache)
         return self.wf
 
 
-    def get_normalised_shape(self):
-        self._read_current_shape()
+    def get_normalised_shape(self, use_cache=True):
+        self._read_current_shape(use_cache)
         return self.nwf
 
 
@@ -47,11 +144,11 @@ class  Awg():
         
 
     def pause_scanning_PVS(self):
-        epics.caput(self.prefix + ':_SelScanDisable', 1)
+        self.pvs.put(self.prefix + ':_SelScanDisable', 1)
 
 
     def start_scanning_PVS(self):
-        epics.caput(self.prefix + ':_SelScanDisable', 0)
+        self.pvs.put(self.prefix + ':_SelScanDisable', 0)
 
 
     def show_error(self, msg, cap):
@@ -65,50 +162,199 @@ class  Awg():
 
 
     def check_write_method(self):
-        if not (self.write_method == "wfm" or self.write_method == "pts"):
-            msg = ("""Invalid choice of AWG write method in config.ini: \n\nValid choices:\n   - wfm (write whole waveform in one go)\n   - pts (write values point by point)\n\nDefaulting to point by point""")
+        if not (self.write_method == "wfm" or self.write_method == "pts" or self.write_method == "bulk"):
+            msg = ("""Invalid choice of AWG write method in config.ini: \n\nValid choices:\n   - wfm (write whole waveform in one go)\n   - bulk (write whole waveform with non-blocking puts)\n   - pts (write values point by point)\n\nDefaulting to point by point""")
             cap = "Config file error"
             self.show_error(msg, cap)
             self.write_method = "pts"
 
 
-    def write(self, points, parent=None, zero_to_end=False):
-        # Wrapper to choose the method to use to write data to hardware
+    def cancel(self):
+        # Ask a write in progress to stop at the next safe point
+        self.cancel_event.set()
+
+
+    def _check_cancel(self, msg):
+        if self.cancel_event.is_set():
+            self.cancelled = True
+            print(get_message_time()+"AWG write cancelled: " + msg)
+        return self.cancelled
+
+
+    def _progress(self, title, msg, maximum, parent):
+        # Progress is reported through a dialog, or through events when running on an AwgWriter
+        if self.progress is not None:
+            return self.progress.begin(title, msg, maximum)
+        if maximum:
+            return wx.ProgressDialog(title, msg, maximum, parent=parent, style=wx.PD_AUTO_HIDE)
+        return wx.ProgressDialog(title, msg, parent=parent, style=wx.PD_AUTO_HIDE)
+
+
+    def write(self, points, parent=None, zero_to_end=False, progress=None):
+        # Wrapper to choose the method to use to write data to hardware. If multi-step
+        # writes are enabled, large changes are split into steps within the max increment.
+        self.progress = progress
+        self.cancelled = False
+        self.cancel_event.clear()
+        if self.multi_step:
+            schedule = self.plan_slew_schedule(points)
+            if len(schedule) > 1:
+                print(get_message_time()+"Change exceeds max increment, writing in %d steps" % len(schedule))
+        else:
+            schedule = [points]
+        for n, step in enumerate(schedule):
+            if n > 0 and self._check_cancel("stopped after step %d of %d" % (n, len(schedule))):
+                break
+            self._write_step(step, parent, zero_to_end and n == 0)
+            if self.cancelled:
+                break
+        if self.verify and not self.cancelled:
+            self.verify_write()
+        self.progress = None
+
+
+    def verify_write(self):
+        # Read the whole shape back in one go and compare it with what we meant to write.
+        # Samples that didn't take are re-sent individually. When the IOC scales the
+        # waveform itself allow for its rounding.
+        intended = np.asarray(self.wf).astype(int)
+        readback = np.asarray(self.get_raw_shape(use_cache=False)).astype(int)
+        n = min(len(intended), len(readback))
+        tolerance = 0 if self.write_method == "pts" else 1
+        mismatched = np.flatnonzero(np.abs(readback[:n] - intended[:n]) > tolerance)
+        self.mismatches.append(len(mismatched))
+        if len(mismatched) == 0:
+            # The readback is now the shape, so cache it as if we'd just written it
+            print(get_message_time()+"Verified %d AWG samples" % n)
+            self._mark_written()
+            return 0
+
+        print(get_message_time()+"%d AWG samples don't match, re-sending: %s" % (len(mismatched), mismatched.tolist()))
+        for i in mismatched:
+            start = time.time()
+            self._pace(start, self._put_sample(i, intended[i]))
+        self._mark_written()
+        return len(mismatched)
+
+
+    def _write_step(self, points, parent=None, zero_to_end=False):
         if self.write_method == "pts":
             self.apply_curve_point_by_point(points, parent, zero_to_end)
         elif self.write_method == "wfm":
             self.write_waveform(points, parent)
+        elif self.write_method == "bulk":
+            self.write_waveform_bulk(points, parent)
         else:
             self.show_error("Unknow method for AWG writing: '%s'" % (self.write_method), "AWG write failed")
+            return
+        self._mark_written()
 
     def write_waveform(self, points, parent=None):
         # Build the waveform
         data = np.zeros(len(self.wf))
         data[0:len(points)]=points
         
-        prog = wx.ProgressDialog("Sending waveform", "Buffering values", parent=parent, style=wx.PD_AUTO_HIDE)
+        prog = self._progress("Sending waveform", "Buffering values", 0, parent)
 
         # Send each of the points to the correct record
         pv_prefix = self.prefix+":HoldSampleNorm"
         for i in range(0, len(data)):
+            if self._check_cancel("waveform not sent, AWG unchanged"):
+                prog.Destroy()
+                return
             pv_name = pv_prefix + str(i)
-            epics.caput(pv_name , data[i])
+            self.pvs.put(pv_name , data[i])
         time.sleep(1)
 
         prog.Pulse("Writing waveform to AWG")
         # Write the whole waveform to the AWG
-        epics.caput(self.prefix+":SetWaveform.PROC", 1)
+        self.pvs.put(self.prefix+":SetWaveform.PROC", 1)
         
         # Wait for the IOC to send not busy before continuing
-        while epics.caget(self.prefix + ":SetWaveformBusy"):
+        while self.pvs.get(self.prefix + ":SetWaveformBusy"):
             prog.Pulse("Waiting for AWG response")
             time.sleep(0.2)
+        self.wf = (data * self.dac).astype(int)
         prog.Destroy()
 
+    def write_waveform_bulk(self, points, parent=None, timeout=10.0, busy_grace=0.2):
+        # Same as write_waveform, but all the hold samples are sent as non-blocking puts
+        # in one go and we wait for the put-completion callbacks rather than sleeping.
+        # The busy flag is watched with a monitor instead of being polled.
+        data = np.zeros(len(self.wf))
+        data[0:len(points)]=points
+
+        prog = self._progress("Sending waveform", "Buffering values", 0, parent)
+
+        # Create all the channels first so the connections are made in parallel
+        pv_prefix = self.prefix+":HoldSampleNorm"
+        names = [pv_prefix + str(i) for i in range(0, len(data))]
+        self.pvs.connect(names)
+        pvs = [self.pvs.get_pv(name) for name in names]
+
+        lock = threading.Lock()
+        remaining = [len(data)]
+        buffered = threading.Event()
+        def on_put_complete(**kws):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] <= 0:
+                    buffered.set()
+
+        for pv, val in zip(pvs, data):
+            pv.put(val, use_complete=True, callback=on_put_complete)
+        if not self._wait_for(buffered, timeout, prog, "Buffering values"):
+            print(get_message_time()+"Error: %d of %d hold samples not acknowledged" % (remaining[0], len(data)))
+            prog.Destroy()
+            return
+        if self._check_cancel("waveform not sent, AWG unchanged"):
+            prog.Destroy()
+            return
+
+        # Watch the busy flag so we know as soon as the IOC has finished
+        busy = threading.Event()
+        idle = threading.Event()
+        def on_busy(value=None, **kws):
+            if value:
+                busy.set()
+            else:
+                idle.set()
+        busy_pv = self.pvs.get_pv(self.prefix + ":SetWaveformBusy")
+        cb_index = busy_pv.add_callback(on_busy)
+
+        # Write the whole waveform to the AWG
+        processed = threading.Event()
+        self.pvs.put(self.prefix+":SetWaveform.PROC", 1, use_complete=True, callback=lambda **kws: processed.set())
+        self._wait_for(processed, timeout, prog, "Writing waveform to AWG")
+
+        # The IOC may raise the busy flag slightly after processing completes
+        if busy_pv.get(use_monitor=True) or busy.wait(busy_grace):
+            if not busy_pv.get(use_monitor=True):
+                idle.set()
+            if not self._wait_for(idle, timeout, prog, "Waiting for AWG response"):
+                print(get_message_time()+"Error: timed out waiting for AWG to finish writing")
+        busy_pv.remove_callback(cb_index)
+        self.wf = (data * self.dac).astype(int)
+        prog.Destroy()
+
+
+    def _wait_for(self, event, timeout, prog, msg):
+        # Wait on an event set from a CA callback, keeping the progress box alive
+        t0 = time.time()
+        while not event.wait(0.05):
+            if time.time() - t0 > timeout:
+                return False
+            prog.Pulse(msg)
+        return True
+
+
     def modify_point(self, i, val):
         incr = 100.0 * math.fabs(val - self.wf[i])/float(self.dac)
 
-        if(incr >= self.max_incr):
+        # A change of exactly the max increment is allowed. clamp_to_slew_limit and
+        # plan_slew_schedule produce steps of exactly that size, which would otherwise
+        # be reported as errors and "clamped" to the same value.
+        if(incr > self.max_incr):
             print(get_message_time()+"Error: increment too big: %.1f percent of DAC - max is %.1f" % (incr, self.max_incr))
 
             if (val - self.wf[i] < 0):
@@ -119,9 +365,103 @@ class  Awg():
             incr = 100.0 * math.fabs(val - self.wf[i])/float(self.dac)
 
         print(get_message_time()+"Modifying point %d from %d to %d : %.1f percent of DAC" % (i, self.wf[i], val, incr))
+        return self._put_sample(i, val)
+
+
+    def _put_sample(self, i, val):
+        # With adaptive pacing wait for the IOC to acknowledge the put so the pacer can 
+        # measure the latency. Returns False if the put timed out.
         name = self.prefix + ":_SetSample" + str(i) + "_do"
+        if self.adaptive_wait:
+            ok = self.pvs.put(name, val, wait=True, timeout=max(1.0, 2*self.wait_time)) != -1
+        else:
+            self.pvs.put(name,val)
+            ok = True
+        # Keep the cached shape in step with the hardware
+        self.wf[i] = val
+        return ok
+
+
+    def _pace(self, start, ok):
+        # Wait before the next point write, either the fixed time or the adaptive one
+        if self.adaptive_wait:
+            elapsed = time.time() - start
+            self.pacer.record(elapsed, ok)
+            time.sleep(max(0, self.pacer.wait - elapsed))
+        else:
+            time.sleep(self.wait_time)
+
+
+    def _quantize(self, points):
+        # Convert a normalised shape to DAC counts. The small offset stops values that
+        # were built from whole counts being truncated down by floating point error.
+        return np.floor(np.asarray(points) * self.dac + 1e-6).astype(int)
+
+
+    def slew_limit(self):
+        # Largest change allowed in one write, in whole DAC counts
+        return max(1, int(math.floor(self.max_incr/100.0 * self.dac)))
+
+
+    def clamp_to_slew_limit(self, counts):
+        # Clamp every sample to within the max increment of the current shape in one go
+        current = np.asarray(self.wf[:len(counts)]).astype(int)
+        limit = self.slew_limit()
+        clamped = current + np.clip(counts - current, -limit, limit)
+        clipped = int(np.count_nonzero(np.logical_and(clamped != counts, counts <= self.dac)))
+        if clipped > 0:
+            print(get_message_time()+"Error: %d samples exceed max increment of %.1f percent of DAC, clipping" % (clipped, self.max_incr))
+        return clamped
+
+
+    def plan_slew_schedule(self, points):
+        # Split the change from the current shape to points into the fewest intermediate
+        # shapes that each stay within the max increment. Returns normalised shapes, the
+        # last of which is points itself.
+        counts = self._quantize(points)
+        current = np.asarray(self.wf[:len(counts)]).astype(int)
+        delta = np.where(counts <= self.dac, counts - current, 0)
+        limit = self.slew_limit()
+        steps = max(1, int(math.ceil(np.amax(np.abs(delta), initial=0) / float(limit))))
+        schedule = [(current + np.clip(delta, -k*limit, k*limit)) / float(self.dac) for k in range(1, steps)]
+        schedule.append(points)
+        return schedule
+
+
+    def plan_writes(self, points, zero_to_end=False):
+        # Quantize the requested shape into DAC counts and compare it with the cached
+        # AWG shape, so that only samples whose value will actually change are sent.
+        # Returns the indices and values to write, and the number of writes skipped.
+        counts = self._quantize(points)
+        current = np.asarray(self.wf[:len(counts)]).astype(int)
+        writable = counts <= self.dac
+        counts = self.clamp_to_slew_limit(counts)
+        changed = np.logical_and(writable, counts != current)
+        indices = np.flatnonzero(changed)
+        values = counts[indices]
+        skipped = int(np.count_nonzero(writable)) - len(indices)
+
+        # If requested, zero anything outside the current range of pulse shaping algorithm
+        if zero_to_end == True:
+            tail = np.flatnonzero(np.asarray(self.wf[len(counts):]) != 0) + len(counts)
+            indices = np.concatenate((indices, tail))
+            values = np.concatenate((values, np.zeros(len(tail), dtype=int)))
+
+        # Write the biggest corrections first, so a partial write gets the most benefit
+        if self.write_order == "priority":
+            current = np.asarray(self.wf).astype(int)[indices]
+            order = np.argsort(-np.abs(values - current), kind='stable')
+            indices = indices[order]
+            values = values[order]
+        return indices, values, skipped
 
-        epics.caput(name,val)
+
+    def _over_budget(self, n, t0):
+        # Any samples left when the time or write budget runs out are picked up by the
+        # next write, as they still differ from the cached shape
+        if self.write_limit > 0 and n >= self.write_limit:
+            return True
+        return self.write_budget > 0 and time.time() - t0 >= self.write_budget
 
 
     def apply_curve_point_by_point(self, points, parent=None, zero_to_end=False):
@@ -129,38 +469,96 @@ class  Awg():
             print(get_message_time()+"Error: size of input list is " + len(points) + ". Expecting " + self.pulse_size) 
             return
 
-        # Setup for a progress box
-        progLength = len(points) if not zero_to_end else len(self.wf)
-        prog= wx.ProgressDialog('Writing to AWG', 'Writing sample 1', progLength, parent=parent, style=wx.PD_AUTO_HIDE)
-
-        for i, point in enumerate(points):
-           val = int(point * self.dac) 
-           if val > self.dac: continue
-           self.modify_point(i, val)
-           #print "simulation - point "+ str(i) + " - value " + str(val) 
-           prog.Update(i, "Writing sample %d" % (i))
-           time.sleep(self.wait_time)
-           #raw_input("continue")
+        indices, values, skipped = self.plan_writes(points, zero_to_end)
+        self.skipped_writes = skipped
+        print(get_message_time()+"Writing %d samples, skipped %d unchanged" % (len(indices), skipped))
 
-        # If requested, zero anything outside the current range of pulse shaping algorithm
-        # Not concerned about changed > max % change here as we're going to zero.
-        if zero_to_end == True:
-            i = len(points)
-            while i < len(self.wf):
-                prog.Update(i, "Writing sample %d" % (i))
-                if self.wf[i] != 0:
-                    print(get_message_time()+"Setting point %d to zero" % i)
-                    epics.caput(self.prefix + ":_SetSample" + str(i) + "_do",0)
-                    time.sleep(self.wait_time)
-                i+=1
+        # Setup for a progress box
+        prog = self._progress('Writing to AWG', 'Writing sample 1', max(len(indices), 1), parent)
+
+        t0 = time.time()
+        written = 0
+        self.deferred_writes = 0
+        for n, (i, val) in enumerate(zip(indices, values)):
+            # Only stop between samples, so every sample is either old or new
+            if self._check_cancel("%d of %d samples written, remaining samples unchanged" % (n, len(indices))):
+                break
+            if self._over_budget(n, t0):
+                self.deferred_writes = len(indices) - n
+                print(get_message_time()+"Write budget used, deferring %d samples to the next iteration" % self.deferred_writes)
+                break
+            start = time.time()
+            if i < len(points):
+                ok = self.modify_point(i, val)
+            else:
+                # Not concerned about changed > max % change here as we're going to zero.
+                print(get_message_time()+"Setting point %d to zero" % i)
+                ok = self._put_sample(i, 0)
+            prog.Update(n, "Writing sample %d" % (i))
+            self._pace(start, ok)
+            written += 1
         prog.Destroy()
 
+        elapsed = time.time() - t0
+        if written > 0 and elapsed > 0:
+            print(get_message_time()+"Wrote %d samples in %.1f s (%.1f writes/s), write wait now %.3f s" % (
+                written, elapsed, written/elapsed, self.pacer.wait if self.adaptive_wait else self.wait_time))
+
+
+    def close(self):
+        self.pvs.close()
+
+
+
+class EventProgress():
+    '''Stands in for wx.ProgressDialog when writing from an AwgWriter, posting the
+        progress to a window as events instead'''
+
+    def __init__(self, window):
+        self.window = window
+        self.title = ""
+        self.maximum = 0
+
+    def begin(self, title, msg, maximum=0):
+        self.title = title
+        self.maximum = maximum
+        self.Update(0, msg)
+        return self
+
+    def Update(self, value, msg=""):
+        wx.PostEvent(self.window, AwgProgressEvent(title=self.title, value=value, maximum=self.maximum, message=msg))
+        return (True, False)
+
+    def Pulse(self, msg=""):
+        # A value of -1 means progress is indeterminate
+        wx.PostEvent(self.window, AwgProgressEvent(title=self.title, value=-1, maximum=0, message=msg))
+        return (True, False)
+
+    def Destroy(self):
+        pass
+
+
+
+class AwgWriter(epics.ca.CAThread):
+    '''Runs Awg.write on a worker thread so the GUI stays responsive. Progress, completion 
+        and errors are posted to window as EVT_AWG_PROGRESS, EVT_AWG_DONE and EVT_AWG_ERROR.
+        cancel() stops the write between samples.'''
+
+    def __init__(self, awg, window, points, zero_to_end=False):
+        epics.ca.CAThread.__init__(self)
+        self.daemon = True
+        self.awg = awg
+        self.window = window
+        self.points = points
+        self.zero_to_end = zero_to_end
+
+    def run(self):
+        try:
+            self.awg.write(self.points, zero_to_end=self.zero_to_end, progress=EventProgress(self.window))
+            wx.PostEvent(self.window, AwgDoneEvent(cancelled=self.awg.cancelled))
+        except Exception as e:
+            print(get_message_time()+"Error writing to AWG: %s" % e)
+            wx.PostEvent(self.window, AwgErrorEvent(error=e))
 
-    def sim_write(self, parent=None):
-            i=0
-            prog = wx.ProgressDialog("Simulated write data", "", self.pulse_size, parent=parent, style=wx.PD_AUTO_HIDE)
-            while i < self.pulse_size:
-                time.sleep(3.0/self.pulse_size)
-                i+=1
-                prog.Update(i, "Write %i of %i" % (i,self.pulse_size))
-            
\ No newline at end of file
+    def cancel(self):
+        self.awg.cancel()
@@ -1,4 +1,6 @@
 import wx, sys, os, epics
+from scope import AVERAGE_METHODS
+from util import RESAMPLE_METHODS
 
 
 if sys.version_info[0] < 3:
@@ -7,6 +9,10 @@ else:
     import configparser as cp
     config = cp.RawConfigParser()
     
+# Notebook page titles for the sections of the config file
+SECTION_TITLES = {"file_locations": "Files", "safety": "Safety", "timing": "Timing", "pvs": "PVs",
+                  "scope": "Scope", "sim": "Simulation", "awg": "AWG", "epics": "EPICS"}
+
 class Configuration(wx.Dialog):
     """
     Hold details of the configuration held in the config file, in addition to user defined configurations
@@ -18,25 +24,56 @@ class Configuration(wx.Dialog):
         wx.Dialog.__init__(self, *args, **kwds)
         self.SetTitle("Beam profiling configuration")
 
+        # Each section of the config file is shown on its own page
+        self.notebook = wx.Notebook(self)
+        self.pages = {}
+
         # Set all the configurable parameters
         self.parms = {}
-        self.parms["diag"] = Param(label = "Diagnostic files location", widget = wx.TextCtrl(self), section = "file_locations")
-        self.parms["curve"] = Param(label = "Library files location", widget = wx.TextCtrl(self), section = "file_locations")
-        self.parms["filter"] = Param(label = "Filter file", widget = wx.TextCtrl(self), section = "file_locations")
-        self.parms["pulse_peak_power"] = Param(kind = "float", label = "Peak Power", widget = wx.TextCtrl(self), section = "safety")
-        self.parms["auto_loop"] = Param(kind = "bool", label = "Auto loop", widget = wx.CheckBox(self), section = "safety")
-        self.parms["auto_loop_wait"] = Param(kind = "float", label = "Auto loop wait (s)", widget = wx.TextCtrl(self), section = "timing")
-        self.parms["scope_wait"] = Param(kind = "float", label = "Scope read wait (s)", widget = wx.TextCtrl(self), section = "timing")
-        self.parms["awg_wait"] = Param(kind = "float", label = "AWG write wait (s)", widget = wx.TextCtrl(self), section = "timing")
-        self.parms["scope"] = Param(label = "Default scope PV", widget = wx.TextCtrl(self), section = "pvs")
-        self.parms["awg_prefix"] = Param(label = "AWG_PV prefix", widget = wx.TextCtrl(self), section = "pvs")
-        self.parms["sim"] = Param(kind = "bool", label = "Simulation", widget = wx.CheckBox(self), section = "sim")
-        self.parms["awg_zero_shift"] = Param(kind = "float", label = "AWG zero shift", widget = wx.TextCtrl(self), section = "awg")
-        self.parms["noise_threshold_percentage"] = Param(kind = "float", label = "Noise threshold (%)", widget = wx.TextCtrl(self), section = "awg")
-        self.parms["awg_ns_per_point"] = Param(kind = "float", label = "AWG calib (ns/point)", widget = wx.TextCtrl(self), section = "awg")
-        self.parms["awg_write_method"] = Param(label = "AWG write method", widget = wx.ComboBox(self, choices=['pts', 'wfm'], style=wx.CB_READONLY), section = "awg")
-        self.parms["epics_ca_addr_list"] = Param(label = "Channel Access addr list", widget = wx.TextCtrl(self), section = "epics")
-        self.parms["epics_ca_auto_addr_list"] = Param(label = "Channel Access auto addr list", widget = wx.ComboBox(self, choices=['No', 'Yes'], style=wx.CB_READONLY), section = "epics")
+        self.parms["diag"] = Param(label = "Diagnostic files location", widget = wx.TextCtrl(self.page("file_locations")), section = "file_locations")
+        self.parms["diag_binary"] = Param(kind = "bool", label = "Save diagnostic files as binary", widget = wx.CheckBox(self.page("file_locations")), section = "file_locations", default = False)
+        self.parms["curve"] = Param(label = "Library files location", widget = wx.TextCtrl(self.page("file_locations")), section = "file_locations")
+        self.parms["filter"] = Param(label = "Filter file", widget = wx.TextCtrl(self.page("file_locations")), section = "file_locations")
+        self.parms["pulse_peak_power"] = Param(kind = "float", label = "Peak Power", widget = wx.TextCtrl(self.page("safety")), section = "safety")
+        self.parms["auto_loop"] = Param(kind = "bool", label = "Auto loop", widget = wx.CheckBox(self.page("safety")), section = "safety")
+        self.parms["auto_loop_wait"] = Param(kind = "float", label = "Auto loop wait (s)", widget = wx.TextCtrl(self.page("timing")), section = "timing")
+        self.parms["scope_wait"] = Param(kind = "float", label = "Scope read wait (s)", widget = wx.TextCtrl(self.page("timing")), section = "timing")
+        self.parms["awg_wait"] = Param(kind = "float", label = "AWG write wait (s)", widget = wx.TextCtrl(self.page("timing")), section = "timing")
+        self.parms["awg_adaptive_wait"] = Param(kind = "bool", label = "Adaptive AWG write wait", widget = wx.CheckBox(self.page("timing")), section = "timing", default = False)
+        self.parms["awg_read_timeout"] = Param(kind = "float", label = "AWG readback timeout (s)", widget = wx.TextCtrl(self.page("timing")), section = "timing", default = 2.0)
+        self.parms["awg_cache_time"] = Param(kind = "float", label = "AWG cached shape lifetime (s)", widget = wx.TextCtrl(self.page("timing")), section = "timing", default = 10.0)
+        self.parms["scope"] = Param(label = "Default scope PV", widget = wx.TextCtrl(self.page("pvs")), section = "pvs")
+        self.parms["awg_prefix"] = Param(label = "AWG_PV prefix", widget = wx.TextCtrl(self.page("pvs")), section = "pvs")
+        self.parms["scope_trigger_delay_suffix"] = Param(label = "Scope trigger delay PV suffix", widget = wx.TextCtrl(self.page("pvs")), section = "pvs", default = "")
+        self.parms["scope_scale_suffix"] = Param(label = "Scope channel vertical scale PV suffix", widget = wx.TextCtrl(self.page("pvs")), section = "pvs", default = "")
+        self.parms["scope_subarray_pv"] = Param(label = "Scope subarray PV (optional)", widget = wx.TextCtrl(self.page("pvs")), section = "pvs", default = "")
+        self.parms["scope_average_method"] = Param(label = "Scope averaging method", widget = wx.ComboBox(self.page("scope"), choices=AVERAGE_METHODS, style=wx.CB_READONLY), section = "scope", default = "mean")
+        self.parms["scope_reject_frames"] = Param(kind = "bool", label = "Reject bad scope frames", widget = wx.CheckBox(self.page("scope")), section = "scope", default = False)
+        self.parms["scope_align"] = Param(kind = "bool", label = "Align scope frames (jitter)", widget = wx.CheckBox(self.page("scope")), section = "scope", default = False)
+        self.parms["scope_adaptive"] = Param(kind = "bool", label = "Adaptive scope averaging", widget = wx.CheckBox(self.page("scope")), section = "scope", default = False)
+        self.parms["scope_snr_fraction"] = Param(kind = "float", label = "Adaptive averaging noise/error fraction", widget = wx.TextCtrl(self.page("scope")), section = "scope", default = 0.2)
+        self.parms["scope_max_averages"] = Param(kind = "int", label = "Adaptive averaging max traces", widget = wx.TextCtrl(self.page("scope")), section = "scope", default = 50)
+        self.parms["live_buffer_frames"] = Param(kind = "int", label = "Live monitor buffer (traces)", widget = wx.TextCtrl(self.page("scope")), section = "scope", default = 64)
+        self.parms["bkg_mode"] = Param(label = "Background", widget = wx.ComboBox(self.page("scope"), choices=['file', 'rolling'], style=wx.CB_READONLY), section = "scope", default = "file")
+        self.parms["bkg_rolling_weight"] = Param(kind = "float", label = "Rolling background update weight", widget = wx.TextCtrl(self.page("scope")), section = "scope", default = 0.05)
+        self.parms["scope_crop_at_source"] = Param(kind = "bool", label = "Only read pulse window from scope", widget = wx.CheckBox(self.page("scope")), section = "scope", default = False)
+        self.parms["sim"] = Param(kind = "bool", label = "Simulation", widget = wx.CheckBox(self.page("sim")), section = "sim")
+        self.parms["sim_put_latency"] = Param(kind = "float", label = "Simulated put latency (s)", widget = wx.TextCtrl(self.page("sim")), section = "sim", default = 0.02)
+        self.parms["sim_busy_time"] = Param(kind = "float", label = "Simulated AWG busy time (s)", widget = wx.TextCtrl(self.page("sim")), section = "sim", default = 0.5)
+        self.parms["sim_noise"] = Param(kind = "float", label = "Simulated scope noise", widget = wx.TextCtrl(self.page("sim")), section = "sim", default = 0.01)
+        self.parms["sim_frame_period"] = Param(kind = "float", label = "Simulated scope frame period (s)", widget = wx.TextCtrl(self.page("sim")), section = "sim", default = 0.1)
+        self.parms["awg_zero_shift"] = Param(kind = "float", label = "AWG zero shift", widget = wx.TextCtrl(self.page("awg")), section = "awg")
+        self.parms["noise_threshold_percentage"] = Param(kind = "float", label = "Noise threshold (%)", widget = wx.TextCtrl(self.page("awg")), section = "awg")
+        self.parms["awg_ns_per_point"] = Param(kind = "float", label = "AWG calib (ns/point)", widget = wx.TextCtrl(self.page("awg")), section = "awg")
+        self.parms["resample_method"] = Param(label = "Scope to AWG resampling", widget = wx.ComboBox(self.page("awg"), choices=RESAMPLE_METHODS, style=wx.CB_READONLY), section = "awg", default = "interp")
+        self.parms["awg_write_method"] = Param(label = "AWG write method", widget = wx.ComboBox(self.page("awg"), choices=['pts', 'wfm', 'bulk'], style=wx.CB_READONLY), section = "awg")
+        self.parms["awg_write_order"] = Param(label = "AWG point write order", widget = wx.ComboBox(self.page("awg"), choices=['index', 'priority'], style=wx.CB_READONLY), section = "awg", default = "index")
+        self.parms["awg_write_budget"] = Param(kind = "float", label = "AWG point write time budget (s, 0 = none)", widget = wx.TextCtrl(self.page("awg")), section = "awg", default = 0.0)
+        self.parms["awg_write_limit"] = Param(kind = "int", label = "AWG point writes per iteration (0 = all)", widget = wx.TextCtrl(self.page("awg")), section = "awg", default = 0)
+        self.parms["awg_verify"] = Param(kind = "bool", label = "Verify AWG writes", widget = wx.CheckBox(self.page("awg")), section = "awg", default = False)
+        self.parms["awg_multi_step"] = Param(kind = "bool", label = "Split large AWG changes into steps", widget = wx.CheckBox(self.page("awg")), section = "awg", default = False)
+        self.parms["epics_ca_addr_list"] = Param(label = "Channel Access addr list", widget = wx.TextCtrl(self.page("epics")), section = "epics")
+        self.parms["epics_ca_auto_addr_list"] = Param(label = "Channel Access auto addr list", widget = wx.ComboBox(self.page("epics"), choices=['No', 'Yes'], style=wx.CB_READONLY), section = "epics")
 
 
 
@@ -47,7 +84,7 @@ class Configuration(wx.Dialog):
         self.buttonSizer = wx.BoxSizer(wx.HORIZONTAL)
         self.buttonSizer.Add(self.okButton)
         self.buttonSizer.Add(self.cancelButton)
-        self.szr = wx.GridBagSizer()
+        self.szr = wx.BoxSizer(wx.VERTICAL)
 
         # Bindings
         self.okButton.Bind(wx.EVT_BUTTON, self.onApply)
@@ -91,15 +128,20 @@ class Configuration(wx.Dialog):
         config.read(filename)
 
         for name, parm in self.parms.items():
+            # Parameters with a default can be missing from older config files
+            fallback = {} if parm.default is None else {'fallback': parm.default}
             # Add special handling if the parameter kind needs it
             if parm.kind == "bool":
-                parm.value = config.getboolean(parm.section, name)
+                parm.value = config.getboolean(parm.section, name, **fallback)
                 parm.widget.SetValue(parm.value)
             elif parm.kind == "float":     
-                parm.value = config.getfloat(parm.section, name)   
+                parm.value = config.getfloat(parm.section, name, **fallback)   
+                parm.widget.SetValue(str(parm.value))
+            elif parm.kind == "int":
+                parm.value = config.getint(parm.section, name, **fallback)
                 parm.widget.SetValue(str(parm.value))
             else:
-                parm.value = config.get(parm.section, name)
+                parm.value = config.get(parm.section, name, **fallback)
                 parm.widget.SetValue(parm.value) 
 
 
@@ -108,6 +150,8 @@ class Configuration(wx.Dialog):
         for name, parm in self.parms.items():
             # Only write out parameters destined for the config file
             if not parm.section: continue 
+            if not config.has_section(parm.section):
+                config.add_section(parm.section)
             value = parm.widget.GetValue()
             config.set(parm.section, name, value)
             # Set the latest values in the parms dictionary
@@ -115,6 +159,8 @@ class Configuration(wx.Dialog):
                 parm.value = bool(value)
             elif parm.kind == "float":     
                 parm.value = float(value)
+            elif parm.kind == "int":
+                parm.value = int(value)
             else:
                 parm.value = value
 
@@ -143,19 +189,35 @@ class Configuration(wx.Dialog):
             os.makedirs(self.parms['diag'].value)
 
 
+    def page(self, section):
+        # The notebook page for a section of the config file, added the first time it's used
+        if section not in self.pages:
+            self.pages[section] = wx.Panel(self.notebook)
+            self.notebook.AddPage(self.pages[section], SECTION_TITLES.get(section, section))
+        return self.pages[section]
+
+
     def __do_layout(self):
         width = 30
-        i=0   
+        sizers = {}
+        rows = {}
+        for section, page in self.pages.items():
+            sizers[section] = wx.GridBagSizer()
+            rows[section] = 0
         for parm in self.parms.values():
             # Only set out widgets for those parms that are set via the config panel
             if parm.widget:
-                label = wx.StaticText(self, label = parm.label)
-                self.szr.Add(label, pos = (i,0), span = (1,1), flag = wx.EXPAND|wx.ALL, border = 5)
-                self.szr.Add(parm.widget, pos = (i,1), span = (1,width), flag = wx.EXPAND|wx.ALL, border = 5)
+                i = rows[parm.section]
+                label = wx.StaticText(self.pages[parm.section], label = parm.label)
+                sizers[parm.section].Add(label, pos = (i,0), span = (1,1), flag = wx.EXPAND|wx.ALL, border = 5)
+                sizers[parm.section].Add(parm.widget, pos = (i,1), span = (1,width), flag = wx.EXPAND|wx.ALL, border = 5)
                 label.SetFont(self.font)
-                i+=1
+                rows[parm.section] = i+1
+        for section, page in self.pages.items():
+            page.SetSizer(sizers[section])
 
-        self.szr.Add(self.buttonSizer, pos=(i,width), flag = wx.EXPAND|wx.ALL, border = 5)
+        self.szr.Add(self.notebook, 1, flag = wx.EXPAND|wx.ALL, border = 5)
+        self.szr.Add(self.buttonSizer, 0, flag = wx.ALIGN_RIGHT|wx.ALL, border = 5)
         self.SetSizerAndFit(self.szr)
         self.Layout()
 
@@ -170,13 +232,15 @@ class Param():
         widget: the widget that will display in the config panel for parms that appear there
         section: the section of the config file that holds the parms, for those that appear there
         value: the current value of the parameter
+        default: the value used when the parm is missing from the config file
     """
-    def __init__(self, kind="string", label="", widget = None, section = None, value = None):
+    def __init__(self, kind="string", label="", widget = None, section = None, value = None, default = None):
         self.kind = kind
         self.label = label
         self.widget = widget
         self.section = section
         self.value = value
+        self.default = default
 
 
 if __name__ == "__main__":
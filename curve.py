@@ -1,11 +1,104 @@
 import numpy as np
-import wx, six
+import wx, os, json, tempfile
+from functools import lru_cache
+from scipy import sparse
 import matplotlib.pyplot as plt
-from util import CODES
+from util import CODES, RESAMPLE_METHODS, get_message_time
+from decimate import DecimatedLine
+
+# Binary curve files start with an 8 byte tag and two little-endian uint64s, the number
+# of points and the offset of the data. A JSON header follows, and the data are stored
+# as little-endian float64 from the offset, which is a multiple of 64, so the file can
+# be memory mapped.
+BINARY_SUFFIX = ".cbin"
+BINARY_TAG = b"BPCURVE1"
+
+
+def is_binary(pathname):
+    with open(pathname, 'rb') as f:
+        return f.read(len(BINARY_TAG)) == BINARY_TAG
+
+
+def save_binary(pathname, data, name="", spacing=None, source=None, timestamp=None):
+    '''
+    Save a 1D array as a binary curve file, with a header giving its name, the sample
+    spacing (s), the PV it came from and the time it was taken (s since the epoch).
+    The file is written alongside and then renamed over pathname, because the old file
+    may be memory mapped, by load_binary here or by another process, and truncating it
+    in place would pull the pages out from under the map.
+    '''
+    # Copy first: data may itself be mapped from the file about to be replaced
+    data = np.array(data, dtype='<f8')
+    header = json.dumps({"name": name, "spacing": spacing, "source": source,
+                         "timestamp": timestamp, "dtype": "<f8"}).encode('utf-8')
+    prefix = len(BINARY_TAG) + 16
+    offset = 64 * int(np.ceil((prefix + len(header)) / 64.0))
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(pathname)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(BINARY_TAG)
+            f.write(np.array([len(data), offset], dtype='<u8').tobytes())
+            f.write(header)
+            f.write(b'\0' * (offset - prefix - len(header)))
+            f.write(data.tobytes())
+        os.replace(temp, pathname)
+    except:
+        os.remove(temp)
+        raise
+
+
+def load_binary(pathname):
+    '''
+    Returns the data of a binary curve file, memory mapped rather than read, and the
+    header as a dict. The map is copy-on-write, so changing the array never changes the file.
+    '''
+    prefix = len(BINARY_TAG) + 16
+    with open(pathname, 'rb') as f:
+        if f.read(len(BINARY_TAG)) != BINARY_TAG:
+            raise ValueError("%s is not a binary curve file" % pathname)
+        points, offset = np.frombuffer(f.read(16), dtype='<u8')
+        header = json.loads(f.read(int(offset) - prefix).rstrip(b'\0').decode('utf-8'))
+    if points == 0:
+        return np.zeros(0), header
+    return np.memmap(pathname, dtype='<f8', mode='c', offset=int(offset), shape=(int(points),)), header
+
+
+def parse_steps(args, kwargs, allowed_steps, unsupported_reason=""):
+    '''
+    Sort out the arguments to process(). Returns a dict of the steps asked for, with
+    their values (True for clip and norm), and the resample method. The steps are done
+    in a fixed order whatever order they were given in.
+    '''
+    supported_args = ["bkg", "crop", "clip", "norm","resample"]
+    kwargs = dict(kwargs)
+    resample_method = kwargs.pop("resample_method", "interp")
+    if resample_method not in RESAMPLE_METHODS:
+        print("Unrecognised resample method: %s. Using interp" % resample_method)
+        resample_method = "interp"
+
+    steps = {}
+    for arg in args:
+        if arg in ["clip", "norm"]:
+            steps[arg] = True
+        if arg not in supported_args:
+            print("Unrecognised argument: %s" % arg)
+
+    for key, value in kwargs.items():
+        if key not in supported_args:
+            print("Unrecognised keyword: %s" % key)
+        elif key not in allowed_steps:
+            print("Ignoring keyword: %s. %s" % (key, unsupported_reason))
+        else:
+            steps[key] = value
+    return steps, resample_method
 
 
 
 class Curve:
+    # The steps process() will do. Subclasses can leave some out.
+    allowed_steps = ["bkg", "crop", "resample", "clip", "norm"]
+    unsupported_reason = ""
+
     def __init__(self, curve_array=np.array([]), name = "unnamed"):
         """
         Creates a Curve object. The intialiser optionally takes the argument 
@@ -18,6 +111,10 @@ class Curve:
         self._trim_method = "off"
         self._curve = np.zeros(self._num_points)
         self._name = name
+        # Saved in the header of binary files
+        self.spacing = None
+        self.source = None
+        self.timestamp = None
         
         if np.alen(curve_array) > 0:
             self._curve = curve_array
@@ -50,7 +147,8 @@ class Curve:
         data: ndarray or string, optional
             If an array is supplied, it will be read directly and num_points and trim_method are 
             ignored. If a string is passed, the file at that path will be loaded. If nothing is 
-            passed, a file dialogue will be shown to choose the file.
+            passed, a file dialogue will be shown to choose the file. Files can be text or
+            binary (see save_binary); binary files are memory mapped rather than read.
         name: string, optional
             The name given to the curve. Defaults to either "manual" if data is supplied,
             or the filename of the loaded curve otherwise.
@@ -95,7 +193,7 @@ class Curve:
             frame.Destroy()
 
         try:
-            self._curve = np.loadtxt(pathname)
+            self._curve = self._read(pathname)
 
             if trim_method == "resample":
                 self._processed = self._resample(self._curve,num_points)
@@ -119,15 +217,38 @@ class Curve:
             
             return CODES.NoError
 
-        except:
-            #print("Can't open the file")
+        except (IOError, OSError, ValueError) as e:
+            print(get_message_time()+"Can't open %s: %s" % (pathname, e))
             return CODES.Error
     
+    def _read(self, pathname):
+        # Binary files are memory mapped. A text file is converted the first time it's
+        # read, and the binary copy beside it is used for as long as it's the newer.
+        if is_binary(pathname):
+            return self._read_binary(pathname)
+        binary = pathname + BINARY_SUFFIX
+        if os.path.exists(binary) and os.path.getmtime(binary) > os.path.getmtime(pathname):
+            return self._read_binary(binary)
+        data = np.loadtxt(pathname)
+        try:
+            save_binary(binary, data, name=pathname.split('/')[-1], timestamp=os.path.getmtime(pathname))
+        except (IOError, OSError) as e:
+            print(get_message_time()+"Couldn't save the binary copy %s: %s" % (binary, e))
+        return data
+
+    def _read_binary(self, pathname):
+        data, header = load_binary(pathname)
+        self.spacing = header.get("spacing")
+        self.source = header.get("source")
+        self.timestamp = header.get("timestamp")
+        return data
+
     def save(self, raw = False, pathname = None):
         """
         save(raw = False, pathname = None)
         
-        Save the curve as a 1D array. 
+        Save the curve as a 1D array. If pathname ends in BINARY_SUFFIX the curve is 
+        saved in the binary format, with its name, spacing, source and timestamp.
 
         Parameters
         ----------
@@ -144,6 +265,7 @@ class Curve:
         out: Text file containg a 1D array
         """
 
+        frame = None
         if not pathname:
             #app = wx.App()
             
@@ -157,19 +279,22 @@ class Curve:
                 if fileDialog == wx.ID_CANCEL: return    # Quit with no save
                 pathname = fileDialog.GetPath()
 
+        data = self._curve if raw else self._processed
         try:
-            if raw:
-                np.savetxt(pathname,self._curve)
+            if pathname.endswith(BINARY_SUFFIX):
+                save_binary(pathname, data, self._name, self.spacing, self.source, self.timestamp)
             else:
-                np.savetxt(pathname,self._processed)
+                np.savetxt(pathname,data)
 
-        except:
-            print("Couldn't save the file")
-        frame.Destroy()
+        except (IOError, OSError) as e:
+            print(get_message_time()+"Couldn't save the file %s: %s" % (pathname, e))
+        if frame:
+            frame.Destroy()
 
     def process(self, *args, **kwargs):
         """
-        process('clip','norm','bkg' = curve_instance, 'crop' = (start_point, length), 'resample' = new_size)
+        process('clip','norm','bkg' = curve_instance, 'crop' = (start_point, length), 'resample' = new_size,
+                'resample_method' = 'interp')
 
         Process the curve to prepare for the feedback loop. Each this is run it starts from the 
         raw curve data, so all desired processing parms must be specified each time.
@@ -190,6 +315,12 @@ class Curve:
                 Slice the trace, starting at start_point for length pixels 
             "resample", optional: int
                 Resample the curve to new_size
+            "resample_method", optional: string
+                How to resample, one of RESAMPLE_METHODS. 'interp' (default) interpolates
+                linearly between the nearest samples. 'block' averages all the samples
+                each new point covers, weighted by how much of each sample falls in it,
+                so noise is averaged down rather than aliased. It only applies when
+                reducing the number of points; otherwise 'interp' is used.
 
         Returns
         -------
@@ -197,69 +328,23 @@ class Curve:
 
         """
 
-        # Reset the curve first
-        self._processed = self._curve
+        steps, resample_method = parse_steps(args, kwargs, self.allowed_steps, self.unsupported_reason)
 
-        supported_args = ["bkg", "crop", "clip", "norm","resample"]
-
-        # Since the order in which this is done is vital, and we can't rely
-        # on preserving in the order of **kwargs before python 3.6, go through
-        # and set flags first then deal with them in the right order. 
-
-        do_bkg = do_crop = do_resample = do_clip = do_norm = False
-
-        for arg in args:
-            if arg == "clip":
-                do_clip = True
-            if arg == "norm":
-                do_norm = True
-            if arg not in supported_args:
-                print("Unrecognised argument: %s" % arg)
-
-        for key, value in six.iteritems(kwargs):
-            if key == "bkg":
-                do_bkg = True
-                val_bkg = value
-            if key == "crop":
-                do_crop = True
-                val_crop = value
-            if key == "resample":
-                do_resample = True
-                val_resample = value
-            if key not in supported_args:
-                print("Unrecognised keyword: %s" % key)
-
-       
-        if do_bkg:
-            # value of "bkg" should be an instance of Curve
-            #print "Sizes %d %d" % (np.size(self._processed), np.size(val_bkg.get_raw()) )
-            self._processed = self._processed - val_bkg.get_raw()
-        if do_crop:
-            start = val_crop[0]
-            stop = val_crop[0] + val_crop[1]
-            self._processed = self._processed[start:stop]
-        if do_resample:
-            self._processed = self._resample(self._processed, val_resample)  
-        if do_clip:
-            self._processed = self._clip_neg(self._processed)
-        if do_norm:
-            self._processed = self._normalise(self._processed)
-
-    # Needs rewrite to average over blocks of 5 points at a time
-    def _resample(self, data, npoints):
-        im = np.arange(0,len(data))
-        ip = np.linspace(0,len(data)-1,npoints)
-        p = np.interp(ip, im, data)
-        return p
-
-    def _clip_neg(self, data):
-        return np.clip(data,0,np.amax(data))
-
-    def _normalise(self,data):
-        if np.amax(np.abs(data)) != 0:
-            return data/np.amax(np.abs(data))
-        else:
-            return data
+        # Each time this is run it starts from the raw curve
+        if len(steps) == 0:
+            self._processed = self._curve
+            return
+        bkg = steps.get("bkg")
+        crop = steps.get("crop")
+        pipeline = get_pipeline(np.alen(self._curve), bkg = bkg is not None,
+                                crop = tuple(crop) if crop is not None else None,
+                                resample = steps.get("resample"),
+                                clip = steps.get("clip", False), norm = steps.get("norm", False),
+                                resample_method = resample_method)
+        self._processed = pipeline.run(self._curve, bkg.get_raw() if bkg is not None else None)
+
+    def _resample(self, data, npoints, method="interp"):
+        return get_pipeline(len(data), resample = npoints, resample_method = method).run(data)
 
     def get_raw(self):
         return self._curve
@@ -267,17 +352,18 @@ class Curve:
     def get_processed(self):
         return self._processed
 
+    # The plots are decimated to the screen resolution, so long traces stay responsive
     def plot_raw(self, *args, **kwargs):
-        plt.plot(self._curve, *args, **kwargs)
+        line = DecimatedLine(plt.gca(), self._curve, *args, **kwargs)
         plt.show(block=True)
 
     def plot_processed(self, *args, **kwargs):
-        plt.plot(self._processed, *args, **kwargs)
+        line = DecimatedLine(plt.gca(), self._processed, *args, **kwargs)
         plt.show(block=True)
 
     def plot_all(self):
-        plt.plot(self._curve, 'g--')
-        plt.plot(self._processed, 'b')
+        raw = DecimatedLine(plt.gca(), self._curve, 'g--')
+        processed = DecimatedLine(plt.gca(), self._processed, 'b')
         plt.show(block=True)
 
     def plot_clear(self):
@@ -292,158 +378,257 @@ class BkgCurve(Curve):
     '''The same a the Curve class, but modify the process methods as we don't want 
         to be able to subtract background from a background curve'''
 
+    allowed_steps = ["crop", "resample", "clip", "norm"]
+    unsupported_reason = "Background curves don't support background subtraction"
+
     def __init__(self, curve_array=np.array([]), name = "unnamed"):
         Curve.__init__(self, curve_array, name)
 
-    def process(self, *args, **kwargs):
-        """
-        process('clip','norm','bkg' = curve_instance, 'crop' = (start_point, length), 'resample' = new_size)
 
-        Process the curve to prepare for the feedback loop. Each this is run it starts from the 
-        raw curve data, so all desired processing parms must be specified each time.
-
-        Parameters
-        ----------
+class TargetCurve(Curve):
+    '''The same a the Curve class, but modify the process methods as we don't want 
+        to be able to subtract background from a target curve'''
 
-        args:
-            "clip", optional:
-                Clip the negative values of the curve, replacing with zeros
-            "norm", optional
-                Normalise the values to 1
-        
-        kwargs:
-            "bkg", optional: Instance of Curve object
-                The Curve containing the background trace to be used
-            "crop", optional: tuple of ints
-                Slice the trace, starting at start_point for length pixels 
-            "resample", optional: int
-                Resample the curve to new_size
+    allowed_steps = ["crop", "resample", "clip", "norm"]
+    unsupported_reason = "Target curves don't support background subtraction"
 
-        Returns
-        -------
-        Results in a processed curve to be accessed by the get_processed() method
+    def __init__(self, curve_array=np.array([]), name = "unnamed"):
+        Curve.__init__(self, curve_array, name)
 
-        """
 
-        # Reset the curve first
-        self._processed = self._curve
 
-        supported_args = ["bkg", "crop", "clip", "norm","resample"]
-
-        # Since the order in which this is done is vital, and we can't rely
-        # on preserving in the order of **kwargs before python 3.6, go through
-        # and set flags first then deal with them in the right order. 
-
-        do_bkg = do_crop = do_resample = do_clip = do_norm = False
-
-        for arg in args:
-            if arg == "clip":
-                do_clip = True
-            if arg == "norm":
-                do_norm = True
-            if arg not in supported_args:
-                print("Unrecognised argument: %s" % arg)
-
-        for key, value in six.iteritems(kwargs):
-            if key == "bkg":
-                print("Ignoring keyword: bkg. Background curves don't support background subtraction")
-            if key == "crop":
-                do_crop = True
-                val_crop = value
-            if key == "resample":
-                do_resample = True
-                val_resample = value
-            if key not in supported_args:
-                print("Unrecognised keyword: %s" % key)
-
-        if do_crop:
-            start = val_crop[0]
-            stop = val_crop[0] + val_crop[1]
-            self._processed = self._processed[start:stop]
-        if do_resample:
-            self._processed = self._resample(self._processed, val_resample)           
-        if do_clip:
-            self._processed = self._clip_neg(self._processed)
-        if do_norm:
-            self._processed = self._normalise(self._processed)
+class Pipeline():
+    '''
+    The processing steps of Curve.process() for curves of one length, set up once so
+    that they are cheap to apply again and again. The crop limits and the resampling
+    index and weight tables are worked out here, and every step writes into buffers
+    allocated here, so run() only does the arithmetic. The steps are always done in the
+    order bkg, crop, resample, clip, norm. Use get_pipeline() rather than making these
+    directly, so that pipelines are shared.
+    '''
+
+    def __init__(self, n_in, bkg=False, crop=None, resample=None, clip=False, norm=False,
+                 resample_method="interp"):
+        self.n_in = n_in
+        self.bkg = bkg
+        self.clip = clip
+        self.norm = norm
+
+        # Crop with the same rules as slicing [start:start+length]
+        if crop is not None:
+            self.start, self.stop, step = slice(crop[0], crop[0] + crop[1]).indices(n_in)
+            self.stop = max(self.stop, self.start)
+        else:
+            self.start, self.stop = 0, n_in
+        n = self.stop - self.start
+        self._cropped = np.empty(n)
+
+        self.resample = None
+        if resample is not None and resample_method == "block" and int(resample) < n:
+            # Sample i covers [i, i+1). Each output point averages the span [j, j+1)*n/resample,
+            # found from the running sum at the span's edges, including the fractions
+            # of the samples cut by an edge
+            self.resample = "block"
+            edges = np.arange(int(resample) + 1) * (n / float(resample))
+            self.edge_index = np.minimum(np.floor(edges).astype(int), n - 1)
+            self.edge_fraction = edges - self.edge_index
+            self.block_width = n / float(resample)
+            self._cumsum = np.zeros(n + 1)
+            self._edges = np.empty(int(resample) + 1)
+            self._partial = np.empty(int(resample) + 1)
+            n = int(resample)
+        elif resample is not None:
+            # Linear interpolation onto points spread evenly over the input, as np.interp
+            self.resample = "interp"
+            points = np.linspace(0, n - 1, int(resample))
+            self.index = np.clip(np.floor(points).astype(int), 0, max(n - 2, 0))
+            self.index_next = np.minimum(self.index + 1, n - 1)
+            self.weight_next = points - self.index
+            self.weight = 1 - self.weight_next
+            self._next = np.empty(int(resample))
+            n = int(resample)
+        self._out = np.empty(n)
+
+
+    def run(self, data, bkg=None):
+        # Returns a new array each time; the buffers are reused
+        if len(data) != self.n_in:
+            raise ValueError("Pipeline is for curves of %d points, not %d" % (self.n_in, len(data)))
+        work = data[self.start:self.stop]
+        if self.bkg:
+            if len(bkg) != self.n_in:
+                raise ValueError("Background has %d points, curve has %d" % (len(bkg), self.n_in))
+            # Subtracting after cropping gives the same result for less work
+            np.subtract(work, bkg[self.start:self.stop], out=self._cropped)
+            work = self._cropped
+        out = self._out
+        if self.resample == "block":
+            np.cumsum(work, out=self._cumsum[1:])
+            np.take(self._cumsum, self.edge_index, out=self._edges)
+            np.take(work, self.edge_index, out=self._partial)
+            self._partial *= self.edge_fraction
+            self._edges += self._partial
+            np.subtract(self._edges[1:], self._edges[:-1], out=out)
+            out /= self.block_width
+        elif self.resample == "interp":
+            np.take(work, self.index, out=out)
+            np.take(work, self.index_next, out=self._next)
+            out *= self.weight
+            self._next *= self.weight_next
+            out += self._next
+        else:
+            out[:] = work
+        if self.clip:
+            np.clip(out, 0, np.amax(out), out=out)
+        if self.norm:
+            peak = np.amax(np.abs(out))
+            if peak != 0:
+                out /= peak
+        return out.copy()
+
+
+
+@lru_cache(maxsize=32)
+def get_pipeline(n_in, bkg=False, crop=None, resample=None, clip=False, norm=False, resample_method="interp"):
+    '''Returns the Pipeline for these steps and input length, made the first time it's asked for'''
+    return Pipeline(n_in, bkg, crop, resample, clip, norm, resample_method)
+
+
+
+class LinearMap():
+    '''
+    The linear steps of Curve.process(), crop and resample, as one sparse matrix from the
+    raw samples to the output points, built from the same tables as the Pipeline.
+    Background subtraction is linear too, so it is done by mapping the background with
+    the same matrix. A frame, or a stack of frames of shape (frames, samples), is then
+    converted with a single sparse product, leaving only clip and norm to do separately.
+    Use get_linear_map() so that the matrix is only built once per set of steps.
+    '''
+
+    def __init__(self, n_in, crop=None, resample=None, resample_method="interp"):
+        p = Pipeline(n_in, crop=crop, resample=resample, resample_method=resample_method)
+        n = p.stop - p.start
+        if p.resample == "block":
+            # Each output point spans samples floor(edge j) to ceil(edge j+1)-1, each
+            # weighted by how much of it is inside the span
+            first = p.edge_index[:-1]
+            last = np.minimum(np.ceil(p.edge_index[1:] + p.edge_fraction[1:]).astype(int) - 1, n - 1)
+            counts = last - first + 1
+            rows = np.repeat(np.arange(len(counts)), counts)
+            cols = first[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+            edges = p.edge_index + p.edge_fraction
+            overlap = np.minimum(cols + 1, edges[rows + 1]) - np.maximum(cols, edges[rows])
+            weights = overlap / p.block_width
+        elif p.resample == "interp":
+            rows = np.tile(np.arange(len(p.index)), 2)
+            cols = np.concatenate((p.index, p.index_next))
+            weights = np.concatenate((p.weight, p.weight_next))
+        else:
+            rows = cols = np.arange(n)
+            weights = np.ones(n)
+        self.n_in = n_in
+        self.n_out = len(p._out)
+        self.matrix = sparse.csr_matrix((weights, (rows, cols + p.start)), shape=(self.n_out, n_in))
+        self._single = None
+
+
+    def apply(self, frames, bkg=None, clip=True, norm=True):
+        # Frames are rows if there is more than one. A background can be one frame for
+        # all of them or one for each. float32 frames stay float32, anything else is
+        # done in float64.
+        frames = np.asarray(frames)
+        if frames.dtype == np.float32:
+            if self._single is None:
+                self._single = self.matrix.astype(np.float32)
+            matrix = self._single
+        else:
+            frames = frames.astype(float, copy=False)
+            matrix = self.matrix
+        out = matrix.dot(frames.T).T
+        if bkg is not None:
+            out -= matrix.dot(np.asarray(bkg, dtype=frames.dtype).T).T
+        if clip:
+            np.clip(out, 0, np.amax(out, axis=-1, keepdims=True), out=out)
+        if norm:
+            peak = np.amax(np.abs(out), axis=-1, keepdims=True)
+            np.divide(out, peak, out=out, where=peak != 0)
+        return out
+
+
+
+@lru_cache(maxsize=32)
+def get_linear_map(n_in, crop=None, resample=None, resample_method="interp"):
+    '''Returns the LinearMap for these steps and input length, made the first time it's asked for'''
+    return LinearMap(n_in, crop, resample, resample_method)
+
+
+
+class CurveStack():
+    '''
+    A stack of curves of the same length, held as one 2-D array of shape (curves, points),
+    for working on many traces at once, e.g. replaying diagnostic runs. process() takes
+    the same arguments as Curve.process() and does the steps for every curve in one
+    vectorised call, with the linear steps done as a single sparse product (see
+    LinearMap). bkg can be a Curve, used for every curve, or a CurveStack with one
+    background per curve. With single=True the data are kept and processed as float32,
+    halving the memory and roughly doubling the speed, at about 1e-7 relative precision.
+    '''
+
+    allowed_steps = Curve.allowed_steps
+    unsupported_reason = ""
+
+    def __init__(self, curve_array=np.zeros((0, 0)), name = "unnamed", single = False):
+        self._dtype = np.float32 if single else float
+        self._curves = np.atleast_2d(np.asarray(curve_array, dtype=self._dtype))
+        self._processed = self._curves
+        self._name = name
 
+    @classmethod
+    def from_curves(cls, curves, raw = True, name = "unnamed", single = False):
+        # Stack the raw (or processed) data of a list of Curves
+        data = [c.get_raw() if raw else c.get_processed() for c in curves]
+        return cls(np.vstack(data), name, single)
 
-class TargetCurve(Curve):
-    '''The same a the Curve class, but modify the process methods as we don't want 
-        to be able to subtract background from a target curve'''
+    def __len__(self):
+        return len(self._curves)
 
-    def __init__(self, curve_array=np.array([]), name = "unnamed"):
-        Curve.__init__(self, curve_array, name)
+    def name(self, name=None):
+        if name:
+            self._name = name
+        else: 
+            return self._name
 
     def process(self, *args, **kwargs):
         """
-        process('clip','norm','bkg' = curve_instance, 'crop' = (start_point, length), 'resample' = new_size)
-
-        Process the curve to prepare for the feedback loop. Each this is run it starts from the 
-        raw curve data, so all desired processing parms must be specified each time.
-
-        Parameters
-        ----------
+        process('clip','norm','bkg' = curve_instance, 'crop' = (start_point, length), 'resample' = new_size,
+                'resample_method' = 'interp')
 
-        args:
-            "clip", optional:
-                Clip the negative values of the curve, replacing with zeros
-            "norm", optional
-                Normalise the values to 1
-        
-        kwargs:
-            "bkg", optional: Instance of Curve object
-                The Curve containing the background trace to be used
-            "crop", optional: tuple of ints
-                Slice the trace, starting at start_point for length pixels 
-            "resample", optional: int
-                Resample the curve to new_size
+        As Curve.process(), for every curve in the stack
+        """
+        steps, resample_method = parse_steps(args, kwargs, self.allowed_steps, self.unsupported_reason)
+        if len(steps) == 0:
+            self._processed = self._curves
+            return
+        crop = steps.get("crop")
+        linear = get_linear_map(self._curves.shape[1], tuple(crop) if crop is not None else None,
+                                steps.get("resample"), resample_method)
+        bkg = steps.get("bkg")
+        self._processed = linear.apply(self._curves, bkg.get_raw() if bkg is not None else None,
+                                       clip = steps.get("clip", False), norm = steps.get("norm", False))
 
-        Returns
-        -------
-        Results in a processed curve to be accessed by the get_processed() method
+    def get_raw(self):
+        return self._curves
 
-        """
+    def get_processed(self):
+        return self._processed
 
-        # Reset the curve first
-        self._processed = self._curve
+    def curve(self, i):
+        # Curve i of the stack as a Curve
+        c = Curve(curve_array = self._curves[i], name = "%s %d" % (self._name, i))
+        c._processed = self._processed[i]
+        return c
 
-        supported_args = ["bkg", "crop", "clip", "norm","resample"]
-
-        # Since the order in which this is done is vital, and we can't rely
-        # on preserving in the order of **kwargs before python 3.6, go through
-        # and set flags first then deal with them in the right order. 
-
-        do_bkg = do_crop = do_resample = do_clip = do_norm = False
-
-        for arg in args:
-            if arg == "clip":
-                do_clip = True
-            if arg == "norm":
-                do_norm = True
-            if arg not in supported_args:
-                print("Unrecognised argument: %s" % arg)
-
-        for key, value in six.iteritems(kwargs):
-            if key == "bkg":
-                print("Ignoring keyword: bkg. Target curves don't support background subtraction")
-            if key == "crop":
-                do_crop = True
-                val_crop = value
-            if key == "resample":
-                do_resample = True
-                val_resample = value
-            if key not in supported_args:
-                print("Unrecognised keyword: %s" % key)
-
-        if do_crop:
-            start = val_crop[0]
-            stop = val_crop[0] + val_crop[1]
-            self._processed = self._processed[start:stop]
-        if do_resample:
-            self._processed = self._resample(self._processed, val_resample)           
-        if do_clip:
-            self._processed = self._clip_neg(self._processed)
-        if do_norm:
-            self._processed = self._normalise(self._processed)   
-    
+    def mean(self):
+        # The mean processed curve, as a Curve
+        c = Curve(curve_array = self._processed.mean(axis=0), name = "%s mean" % self._name)
+        return c
@@ -0,0 +1,109 @@
+import numpy as np
+from collections import OrderedDict
+
+
+def minmax_decimate(x, y, n_bins):
+    '''
+    Reduce a trace to the minimum and maximum of y in each of n_bins equal bins of
+    samples, so that peaks and noise spread are kept however far it's reduced. Returns
+    x and y arrays of 2*n_bins points, each bin's min and max in the order they occur.
+    Traces with no more than 2*n_bins points are returned unchanged. NaNs are ignored,
+    except that a bin of nothing but NaNs gives its first sample twice, to leave a gap.
+    '''
+    n = len(y)
+    if n <= 2*n_bins:
+        return x, y
+    edges = np.linspace(0, n, n_bins + 1).astype(int)[:-1]
+    lo = np.fmin.reduceat(y, edges)
+    hi = np.fmax.reduceat(y, edges)
+    # Positions of the extremes within each bin, to order them and place them in x
+    counts = np.diff(np.append(edges, n))
+    bin_index = np.repeat(np.arange(n_bins), counts)
+    is_lo = y == lo[bin_index]
+    is_hi = y == hi[bin_index]
+    lo_index = _first_in_bins(is_lo, edges)
+    hi_index = _first_in_bins(is_hi, edges)
+    first = np.minimum(lo_index, hi_index)
+    second = np.maximum(lo_index, hi_index)
+    index = np.column_stack((first, second)).ravel()
+    return x[index], y[index]
+
+
+def _first_in_bins(mask, edges):
+    # Index of the first True in each bin starting at edges, or the start of the bin if
+    # it has none, which only happens when the bin is all NaN
+    hits = np.append(np.flatnonzero(mask), len(mask))
+    first = hits[np.searchsorted(hits, edges)]
+    ends = np.append(edges[1:], len(mask))
+    return np.where(first < ends, first, edges)
+
+
+
+class DecimatedLine():
+    '''
+    A line on a matplotlib axes that only ever draws about two points per pixel of the
+    axes width, using minmax_decimate. The visible part is decimated again whenever the
+    x limits change, so zooming in with the navigation toolbar shows full detail, and
+    each view's decimation is cached so going back and forth is free. Otherwise it is
+    used like the Line2D that axes.plot() returns: a format string and keyword arguments
+    go to axes.plot(), and set_data/set_ydata replace the data. x must be increasing.
+    The axes only holds a weak reference to it, so keep a reference while it's shown.
+    '''
+
+    def __init__(self, axes, x, y=None, *args, cache_size=32, **kwargs):
+        if y is None or isinstance(y, str):
+            # Called as (axes, y) or (axes, y, fmt), as for axes.plot()
+            args = (y,) + args if y is not None else args
+            x, y = np.arange(len(x)), x
+        self.axes = axes
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.line = axes.plot([], [], *args, **kwargs)[0]
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        # The axes only sees the decimated points, so tell it the full extent
+        if len(self.y) > 0:
+            axes.update_datalim([(np.amin(self.x), np.amin(self.y)), (np.amax(self.x), np.amax(self.y))])
+            axes.autoscale_view()
+        self.cid = axes.callbacks.connect('xlim_changed', self._on_xlim)
+        self.update()
+
+
+    def set_data(self, x, y):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.cache.clear()
+        self.update()
+
+
+    def set_ydata(self, y):
+        self.set_data(self.x, y)
+
+
+    def get_ydata(self):
+        return self.y
+
+
+    def _on_xlim(self, axes):
+        self.update()
+
+
+    def update(self):
+        # Decimate the samples in view plus one either side, so the line reaches the edges
+        xmin, xmax = self.axes.get_xlim()
+        start = max(np.searchsorted(self.x, xmin) - 1, 0)
+        stop = min(np.searchsorted(self.x, xmax, side='right') + 1, len(self.x))
+        width = max(int(self.axes.get_window_extent().width), 1)
+        key = (start, stop, width)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            self.cache[key] = minmax_decimate(self.x[start:stop], self.y[start:stop], width)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        self.line.set_data(*self.cache[key])
+
+
+    def remove(self):
+        self.axes.callbacks.disconnect(self.cid)
+        self.line.remove()
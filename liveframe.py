@@ -0,0 +1,106 @@
+import matplotlib
+matplotlib.use('WXAgg')
+from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigCanvas
+from matplotlib.backends.backend_wx import NavigationToolbar2Wx as NavigationToolbar
+import time, pylab, wx
+import numpy as np
+import matplotlib.pyplot as plt
+from curve import get_linear_map
+from decimate import DecimatedLine
+
+
+class LiveFrame(wx.Frame):
+    ''' Shows the processed pulse shape from the live monitor buffer against the target,
+        with the rms error, updated continuously'''
+
+    def __init__(self, parent, monitor, target, background, crop, num_points, averages, ns_per_point,
+                 resample_method="interp", refresh=0.2):
+        wx.Frame.__init__(self, parent, size=(600,450), title="Live monitor")
+        self.parent = parent
+        self.monitor = monitor
+        self.target = target/np.max(target)
+        self.background = background
+        self.crop = crop
+        self.num_points = num_points
+        self.resample_method = resample_method
+        self.averages = averages
+        self.last_written = 0
+        self.last_time = time.time()
+        self.rms_history = []
+
+        self.vbox = wx.BoxSizer(wx.VERTICAL)
+        self.init_plot(ns_per_point)
+        self.canvas = FigCanvas(self, -1, self.fig)
+        self.toolbar = NavigationToolbar(self.canvas)
+        self.toolbar.Realize()
+        self.vbox.Add(self.canvas, 1, flag=wx.LEFT | wx.TOP | wx.GROW)
+        self.vbox.Add(self.toolbar, 0, wx.LEFT | wx.EXPAND)
+        self.SetSizer(self.vbox)
+        self.vbox.Fit(self)
+
+        # Redraw from the buffer on a timer, so the GUI never waits on the scope
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.Bind(wx.EVT_CLOSE, self.close_window)
+        self.timer.Start(int(1000*refresh))
+        self.Show()
+
+
+    def init_plot(self, ns_per_point):
+        self.dpi = 100
+        self.fig = plt.Figure((6.0, 4.0), dpi=self.dpi)
+        self.curve_axis = self.fig.add_subplot(211)
+        self.rms_axis = self.fig.add_subplot(212)
+        pylab.setp(self.curve_axis.get_xticklabels(), fontsize=8)
+        pylab.setp(self.curve_axis.get_yticklabels(), fontsize=8)
+        pylab.setp(self.rms_axis.get_xticklabels(), fontsize=8)
+        pylab.setp(self.rms_axis.get_yticklabels(), fontsize=8)
+        self.curve_axis.set_xlabel('Time (ns)', fontsize=8)
+        self.curve_axis.set_title('Pulse Shape')
+        self.rms_axis.set_xlabel('Update', fontsize=8)
+        self.rms_axis.set_ylabel('RMS error', fontsize=8)
+
+        time_axis = np.arange(self.num_points)*ns_per_point
+        self.curve_plot_data = DecimatedLine(self.curve_axis,
+            time_axis, np.zeros(self.num_points), label = 'Live')
+        self.target_plot_data = DecimatedLine(self.curve_axis,
+            time_axis, self.target, label = 'Target')
+        self.curve_axis.legend(loc=8, prop={'size':8})
+        self.curve_axis.set_ybound(lower=-0.1, upper=1.2)
+        self.rms_plot_data = self.rms_axis.plot([], [])[0]
+        self.fig.tight_layout()
+        self.statusBar = wx.StatusBar(self, -1)
+        self.SetStatusBar(self.statusBar)
+
+
+    def on_timer(self, event):
+        written = self.monitor.ring.written
+        now = time.time()
+        rate = (written - self.last_written) / (now - self.last_time)
+        self.last_time = now
+        if written == self.last_written:
+            self.statusBar.SetStatusText("Waiting for scope frames")
+            return
+        self.last_written = written
+
+        frames = self.monitor.latest(self.averages)
+        if len(frames) == 0:
+            return
+        live_map = get_linear_map(self.monitor.ring.length, tuple(self.crop), self.num_points, self.resample_method)
+        shape = live_map.apply(frames.mean(axis=0), bkg=self.background.get_raw())
+        rms = np.sqrt(np.mean(np.square(self.target - shape)))
+        self.rms_history = (self.rms_history + [rms])[-200:]
+
+        self.curve_plot_data.set_ydata(shape)
+        self.rms_plot_data.set_data(np.arange(len(self.rms_history)), self.rms_history)
+        self.rms_axis.relim()
+        self.rms_axis.autoscale_view()
+        self.curve_axis.set_title('Pulse Shape (rms error %.4f)' % rms)
+        self.canvas.draw_idle()
+        self.statusBar.SetStatusText("%d frames averaged, %.1f frames/s" % (len(frames), rate))
+
+
+    def close_window(self, event):
+        self.timer.Stop()
+        self.parent.on_live_closed()
+        self.Destroy()
@@ -0,0 +1,127 @@
+import queue, multiprocessing
+import numpy as np
+import epics
+from scope import ScopeAcquirer
+from util import get_message_time
+
+
+class TraceRing():
+    '''
+    Fixed size ring buffer of scope frames in shared memory, so that one process can
+    stream frames in while others read them without copying. The block holds an int64
+    header [frames written, capacity, frame length] followed by a capacity x length
+    array of float64 frames. Frame i is stored in slot i % capacity.
+
+    Create a new ring with capacity and length, or wrap the block of an existing one,
+    which is a multiprocessing RawArray and so can be passed to a child process.
+    There is a single writer. Readers don't lock: latest() checks the write count
+    before and after reading and drops any frame the writer may have overwritten.
+    '''
+
+    HEADER = 3
+
+    def __init__(self, capacity=None, length=None, block=None):
+        new = block is None
+        if new:
+            block = multiprocessing.RawArray('b', 8 * (self.HEADER + capacity * length))
+        self.block = block
+        self.header = np.frombuffer(block, dtype=np.int64, count=self.HEADER)
+        if new:
+            self.header[:] = (0, capacity, length)
+        self.capacity = int(self.header[1])
+        self.length = int(self.header[2])
+        # The frames themselves, as a view on the shared block
+        self.frames = np.frombuffer(block, dtype=np.float64, offset=8 * self.HEADER).reshape(
+            (self.capacity, self.length))
+
+
+    @property
+    def written(self):
+        return int(self.header[0])
+
+
+    def push(self, frame):
+        # Frames of the wrong length are truncated or zero padded to fit
+        i = self.written
+        slot = self.frames[i % self.capacity]
+        n = min(len(frame), self.length)
+        slot[:n] = frame[:n]
+        slot[n:] = 0
+        self.header[0] = i + 1
+
+
+    def latest(self, n):
+        '''
+        Return a copy of the most recent n frames, oldest first. Fewer are returned if
+        fewer have been written, or if the writer overtook the read.
+        '''
+        end = self.written
+        n = min(n, end, self.capacity)
+        index = np.arange(end - n, end)
+        frames = self.frames[index % self.capacity]
+        # Frame i's slot is reused when frame i + capacity is written
+        oldest_safe = self.written - self.capacity + 1
+        return frames[index >= oldest_safe]
+
+
+    def close(self):
+        # Drop the views, so the block is freed once no process holds it
+        self.frames = None
+        self.header = None
+        self.block = None
+
+
+
+def stream_frames(block, pvname, stop):
+    '''
+    Push every new frame from the scope PV into the TraceRing on block until stop is set.
+    This is the body of the LiveMonitor acquisition process.
+    '''
+    ring = TraceRing(block=block)
+    pv = epics.PV(pvname, auto_monitor=True)
+    pv.wait_for_connection()
+    scope = ScopeAcquirer(pv)
+    # Every frame is wanted here, not just those during an acquire()
+    scope.collecting.set()
+    while not stop.is_set():
+        try:
+            frame = scope.frames.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        ring.push(frame)
+    scope.close()
+    pv.disconnect()
+    ring.close()
+
+
+
+class LiveMonitor():
+    '''
+    Streams scope frames continuously into a TraceRing from a separate acquisition
+    process, so that a live display and the loop can use the most recent frames without
+    waiting for new ones.
+    '''
+
+    def __init__(self, pvname, length, capacity=64):
+        self.pvname = pvname
+        self.ring = TraceRing(capacity, length)
+        self.stop_event = multiprocessing.Event()
+        self.worker = epics.ca.CAProcess(target=stream_frames,
+                                         args=(self.ring.block, pvname, self.stop_event))
+        self.worker.daemon = True
+        self.worker.start()
+        print(get_message_time()+"Live monitor streaming %s into a %d frame buffer" % (pvname, capacity))
+
+
+    def latest(self, n):
+        return self.ring.latest(n)
+
+
+    def is_running(self):
+        return self.worker.is_alive()
+
+
+    def stop(self):
+        self.stop_event.set()
+        self.worker.join(2.0)
+        self.ring.close()
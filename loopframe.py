@@ -1,5 +1,7 @@
 from util import get_message_time, CODES, RedirectText
-from awg import Awg
+from awg import Awg, AwgWriter, EVT_AWG_PROGRESS, EVT_AWG_DONE, EVT_AWG_ERROR
+from sim_ioc import SimIoc
+from scope import ScopeAcquirer, StackAverage, SettingsWatcher, RollingBackground
 import matplotlib
 matplotlib.use('WXAgg')
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigCanvas
@@ -9,7 +11,8 @@ import numpy as np
 import epics
 from datetime import datetime
 import matplotlib.pyplot as plt
-from curve import Curve
+from curve import Curve, get_linear_map, BINARY_SUFFIX
+from decimate import DecimatedLine
 from loopControlDialog import LoopControlDialog
 
 
@@ -45,8 +48,8 @@ class LoopFrame(wx.Frame):
         self.slice_length = config.getVal('length')
         self.scope_pv = config.getVal('scope_pv')
         self.time_resolution_pv = config.getVal('time_res_pv')
-        self.time_res = self.time_resolution_pv.get()
         self.scope_averages = config.getVal('averages')
+        self.live_monitor = config.getVal('live_monitor')
         self.gain = config.getVal('gain')
         self.iterations = config.getVal('iterations')
         self.tolerance = config.getVal('tolerance')
@@ -54,12 +57,23 @@ class LoopFrame(wx.Frame):
         self.save_diag_files = config.getVal('save_diag_files')
         self.num_points = int(float(self.pulse_length/config.getVal('awg_ns_per_point')))
         self.i = 0 #Store the loop count for stopping/restarting loop
-        self.update_feedback_curve()  
-        
+        self.pv_factory = epics.PV
         if self.sim == True:
-            self.current_output = self.simulate_start_data()    
+            self.start_sim_ioc()
+        self.time_res = self.time_resolution_pv.get()
+        self.watch_scope_settings()
+        self.start_scope()
+        self.start_background()
+        self.target_region = self.find_target_region()
+        if self.update_feedback_curve(use_live=True) == CODES.Error:
+            # No starting shape from the scope, so don't open the window
+            print(get_message_time()+"Couldn't read the scope, loop not started")
+            self.stop_acquisition()
+            self.Destroy()
+            return
+        
         self.correction_factor = np.zeros(np.alen(self.current_output))
-        self.awg = Awg(self.config, self.num_points , self.max_percent_change)
+        self.awg = Awg(self.config, self.num_points , self.max_percent_change, pv_factory=self.pv_factory)
             
         # Create a panel to hold a log output
         log_panel = wx.Panel(self, wx.ID_ANY)
@@ -73,6 +87,7 @@ class LoopFrame(wx.Frame):
         log_stream = RedirectText(log)
         self.standard_stdout = sys.stdout
         sys.stdout=log_stream
+        self.awg.pvs.print_stats()
         
         # Canvas to hold the plots
         self.vbox = wx.BoxSizer(wx.VERTICAL)
@@ -91,6 +106,11 @@ class LoopFrame(wx.Frame):
             # Used to restart a paused loop
             self.add_continue_button()
         self.stop_loop = False
+        self.writer = None
+        self.closing = False
+        self.Bind(EVT_AWG_PROGRESS, self.on_awg_progress)
+        self.Bind(EVT_AWG_DONE, self.on_awg_done)
+        self.Bind(EVT_AWG_ERROR, self.on_awg_error)
         self.vbox.Add(self.hbox, 0, flag=wx.LEFT | wx.TOP | wx.GROW)
         self.SetSizer(self.vbox)
         self.vbox.Fit(self)
@@ -129,22 +149,47 @@ class LoopFrame(wx.Frame):
         
      
     def on_continue(self, event):
+        if self.writer is not None:
+            # Still writing the last correction
+            return
         if self.i<self.iterations and self.rms_error()>=self.tolerance:
             self.run_loop()
 
             
     def on_stop(self, event):
         self.stop_loop = True
+        if self.writer is not None:
+            self.writer.cancel()
 
                 
     def close_window(self, event):
         # Restore stdout to normal, and enable the parent before closing
         self.stop_loop = True
+        if self.writer is not None:
+            # Let the write stop cleanly first, on_awg_done closes the window
+            self.writer.cancel()
+            self.closing = True
+            if event.CanVeto():
+                event.Veto()
+                return
+            self.writer.join()
+        self.awg.close()
+        self.stop_acquisition()
         sys.stdout = self.standard_stdout
         self.parent.Enable()
         self.parent.SetTransparent(255)
         self.Destroy()
 
+
+    def stop_acquisition(self):
+        # Release the scope monitors, and the simulator if it's running
+        self.scope.close()
+        self.scope_settings.close()
+        if self.crop_at_source:
+            self.acquisition_pv.disconnect()
+        if self.sim == True:
+            self.sim_ioc.stop()
+
         
     def init_plot(self):       
         # create the plots and add some labels
@@ -170,22 +215,19 @@ class LoopFrame(wx.Frame):
         time_axis = np.arange(0, self.num_points*self.config.getVal('awg_ns_per_point'), self.config.getVal('awg_ns_per_point'))
 
         # add data to the plots
-        self.corr_plot_data = self.correction_axis.plot(
-            time_axis,self.correction_factor, label = 'Correction')[0]        
-        self.curve_plot_data = self.curve_axis.plot(
-            time_axis,self.current_output, label = 'Current')[0]
-        self.target_plot_data = self.curve_axis.plot(
-            time_axis,self.target, label = 'Target')[0]
+        self.corr_plot_data = DecimatedLine(self.correction_axis,
+            time_axis,self.correction_factor, label = 'Correction')        
+        self.curve_plot_data = DecimatedLine(self.curve_axis,
+            time_axis,self.current_output, label = 'Current')
+        self.target_plot_data = DecimatedLine(self.curve_axis,
+            time_axis,self.target, label = 'Target')
         self.curve_axis.legend(loc=8, prop={'size':8})
         self.curve_axis.set_ybound(lower=-0.1, upper=1.2)
-        if not self.config.parms['sim'].value:
-            awg_start = self.awg.get_normalised_shape()[:self.num_points]
-        else: 
-            awg_start = self.correction_factor
-        self.awg_now_plot_data = self.awg_axis.plot(
-            time_axis,awg_start, label = 'AWG current')[0]
-        self.awg_next_plot_data = self.awg_axis.plot(
-            time_axis,awg_start, label = 'AWG next')[0]
+        awg_start = self.awg.get_normalised_shape()[:self.num_points]
+        self.awg_now_plot_data = DecimatedLine(self.awg_axis,
+            time_axis,awg_start, label = 'AWG current')
+        self.awg_next_plot_data = DecimatedLine(self.awg_axis,
+            time_axis,awg_start, label = 'AWG next')
         self.awg_axis.legend(loc=8, prop={'size':8})
         self.awg_axis.set_ybound(lower = -0.1, upper = 1.2)
         self.statusBar = wx.StatusBar(self, -1)
@@ -268,58 +310,81 @@ class LoopFrame(wx.Frame):
     def run_loop(self):   
         self.draw_plots()
         wx.SafeYield(self) # Lets the plot update
-        proceed = -1
-        
+        self.proceed = -1
+        self.next_iteration()
+
+
+    def next_iteration(self):
+        # One pass of the loop, up to starting the AWG write. When the write ends
+        # finish_iteration completes the pass and starts the next one.
         # If auto loop is off, loop continuously until user quits, else loop until 
         # max iterations or RMS value reached
-        while (not self.auto_loop) or (self.i<self.iterations and self.rms_error()>=self.tolerance):                      
+        if self.auto_loop and not (self.i<self.iterations and self.rms_error()>=self.tolerance):
+            return self.end_loop()
 
-            self.calculate_parms_for_loop()
+        self.calculate_parms_for_loop()
 
-            # Draw plots and check if the user wants to continue
-            self.draw_plots()
-            self.draw_awg_plots() 		             
-            wx.SafeYield(self)
-            proceed = self.check_proceed()                
-
-            if proceed == CODES.Abort: 
-                print(get_message_time()+"Quitting loop. AWG curve will not be applied")
-                break
-            elif proceed == CODES.Pause:
-                print(get_message_time()+"Loop paused") 
-                break
-            elif proceed == CODES.Recalc:
-                break
-            
-            if self.save_diag_files:
-                self.save_files()
-            
-            # If the next AWG trace would be unsafe, don't apply it and quit
-            if self.peak_power() > self.pulse_peak_power:
-                print(get_message_time()+"Quitting loop: proposed curve would exceed peak power")
-                self.show_error("Quitting loop: proposed curve would exceed peak power", "Quitting loop")
-                break
-
-            # Check if user stopped the loop
-            if self.stop_loop:
-                print(get_message_time()+"Quitting loop: user stop")
-                break
-
-            self.apply_correction()
-            err = self.update_feedback_curve()
-            if err == CODES.Error:
-                print(get_message_time()+"Quitting loop: couldn't update feedback curve")
-                self.show_error("Quitting loop: couldn't update feedback curve", "Quitting loop")
-                break
-
-            # Increase the iteration number and loop again
-            self.i+=1
+        # Draw plots and check if the user wants to continue
+        self.draw_plots()
+        self.draw_awg_plots() 		             
+        wx.SafeYield(self)
+        self.proceed = self.check_proceed()                
+
+        if self.proceed == CODES.Abort: 
+            print(get_message_time()+"Quitting loop. AWG curve will not be applied")
+            return self.end_loop()
+        elif self.proceed == CODES.Pause:
+            print(get_message_time()+"Loop paused") 
+            return self.end_loop()
+        elif self.proceed == CODES.Recalc:
+            return self.end_loop()
+        
+        if self.save_diag_files:
+            self.save_files()
+        
+        # If the next AWG trace would be unsafe, don't apply it and quit
+        if self.peak_power() > self.pulse_peak_power:
+            print(get_message_time()+"Quitting loop: proposed curve would exceed peak power")
+            self.show_error("Quitting loop: proposed curve would exceed peak power", "Quitting loop")
+            return self.end_loop()
+
+        # Check if user stopped the loop
+        if self.stop_loop:
+            print(get_message_time()+"Quitting loop: user stop")
+            return self.end_loop()
+
+        self.apply_correction()
+
+
+    def finish_iteration(self, result):
+        # The rest of the pass, once the AWG write has ended
+        self.write_prog.Destroy()
+        self.awg.start_scanning_PVS() #Restart the comms now finished writing
+        self.writer = None
+        if self.closing:
+            # The window was closed during the write
+            self.Close()
+            return
+        if result == CODES.Abort:
+            print(get_message_time()+"Quitting loop: AWG write did not complete")
+            return self.end_loop()
+        err = self.update_feedback_curve()
+        if err == CODES.Error:
+            print(get_message_time()+"Quitting loop: couldn't update feedback curve")
+            self.show_error("Quitting loop: couldn't update feedback curve", "Quitting loop")
+            return self.end_loop()
 
+        # Increase the iteration number and loop again, once this event has been handled
+        self.i+=1
+        wx.CallAfter(self.next_iteration)
+
+
+    def end_loop(self):
         # After the loop has finished plot the final data. Use the applied AWG trace from the last iteration
         # rather than re-read the AWG values from hardware. The two shouldn't differ unless there was a problem.
         self.draw_plots()
         wx.SafeYield(self) # Needed to allow processing events to stop loop and let plot update
-        self.loop_end_message(proceed)
+        self.loop_end_message(self.proceed)
 
 
     def loop_end_message(self, proceed):
@@ -373,57 +438,112 @@ class LoopFrame(wx.Frame):
 
 
     def apply_correction(self):
-        if self.sim == True:
-            self.current_output = self.awg_next_norm
-            self.awg.sim_write(self.parent)
-            print(get_message_time()+"Applied correction for iteration %i" % (self.i+1))
+        # Write the new AWG trace to the hardware. The write runs on a worker thread and
+        # reports back through events, so the window (and the Stop button) stay live.
+        # on_awg_done or on_awg_error carries on with the loop when it ends.
+        self.awg.pause_scanning_PVS() #Stop IDIL/AWG comms while writing curve
+        time.sleep(1) #Let the message buffer clear
+        self.write_prog = wx.ProgressDialog("Writing to AWG", "Starting write", 100, parent=self.parent, 
+                                            style=wx.PD_AUTO_HIDE|wx.PD_CAN_ABORT)
+        # On the first pass only, set any AWG samples outside the pulse to zero
+        self.writer = AwgWriter(self.awg, self, self.awg_next_norm, zero_to_end=(self.i==0))
+        self.writer.start()
+
+
+    def on_awg_progress(self, event):
+        if self.writer is None:
+            # Posted before the write ended, but handled after
+            return
+        if event.value < 0 or not event.maximum:
+            keep_going = self.write_prog.Pulse(event.message)[0]
         else:
-            # Write the new AWG trace to the hardware
-            self.awg.pause_scanning_PVS() #Stop IDIL/AWG comms while writing curve
-            time.sleep(1) #Let the message buffer clear
-            if self.i==0:
-                # On the first pass only, set any AWG samples outside the pulse to zero
-                self.awg.write(self.awg_next_norm, parent=self.parent, zero_to_end=True)
-            else:
-                self.awg.write(self.awg_next_norm, parent=self.parent, zero_to_end=False)
-            self.awg.start_scanning_PVS() #Restart the comms now finished writing
-        wx.SafeYield(self)
+            keep_going = self.write_prog.Update(int(100.0*event.value/event.maximum), event.message)[0]
+        if not keep_going:
+            self.writer.cancel()
 
 
-    def update_feedback_curve(self):
-        if self.sim == True:
-            # Don't bother with background correction for simulation mode, so 
-            # just return
-            return CODES.NoError
-        
-        # Check if scope settings have changed. We could deal with this if they have, but for now
-        # just warn user and exit
-        if self.time_resolution_pv.get() != self.time_res:
-            print(get_message_time()+"Scope time resolution has changed since loop started")
-            self.show_error("Scope time resolution has changed since loop started", "Scope settings")
+    def on_awg_done(self, event):
+        if event.cancelled:
+            self.finish_iteration(CODES.Abort)
+        else:
+            print(get_message_time()+"Applied correction for iteration %i" % (self.i+1))
+            self.finish_iteration(CODES.NoError)
+
+
+    def on_awg_error(self, event):
+        if not self.closing:
+            self.show_error("Error writing to AWG:\n\n%s" % event.error, "AWG write failed")
+        self.finish_iteration(CODES.Abort)
+
+
+    def update_feedback_curve(self, use_live=False):
+        # Check if scope settings have changed. A new time base can be dealt with by
+        # moving the pulse window, anything else needs the user to check the setup.
+        changes = self.scope_settings.changes()
+        if list(changes.keys()) == ['time resolution']:
+            self.rescale_time_base(changes['time resolution'])
+            self.scope_settings.accept()
+        elif len(changes) > 0:
+            msg = "Scope %s changed since loop started" % (", ".join(sorted(changes.keys())))
+            print(get_message_time()+msg)
+            self.show_error(msg, "Scope settings")
             return CODES.Error
 
-        cropping = (self.slice_start, self.slice_length)      
-        datas=[]
-        i=0
-        if self.scope_pv.connected:
-            prog = wx.ProgressDialog("Getting scope data", "Reading trace 1", self.scope_averages, 
+        # In adaptive mode keep averaging until the noise is small compared with the
+        # current error, up to a maximum. Before the first error is known the fixed
+        # number of averages is used.
+        averages = self.scope_averages
+        done = None
+        if self.config.getVal('scope_adaptive') and self.rms_error() > 0:
+            averages = self.config.getVal('scope_max_averages')
+            done = self.enough_averages
+
+        # Frames already in the live monitor buffer can be used straight away
+        frames = self.live_frames() if use_live else []
+        if len(frames) > 0:
+            print(get_message_time()+"Using %d frames from the live monitor" % (len(frames)))
+            running = StackAverage(frames, method=self.config.getVal('scope_average_method'),
+                                   reject=self.config.getVal('scope_reject_frames'),
+                                   align=self.config.getVal('scope_align'))
+        elif self.scope_pv.connected:
+            prog = wx.ProgressDialog("Getting scope data", "Reading trace 1", averages, 
                                      style=wx.PD_AUTO_HIDE, parent=self.parent)
-            while i < self.scope_averages:
-                data = self.scope_pv.get()
-                datas.append(data)
-                time.sleep(self.config.getVal('scope_wait'))
-                i+=1
-                prog.Update(i,"Reading trace %d" % (i))                                   
+            # Collect distinct frames as they arrive. Give up if nothing new turns up
+            # in twice the configured scope wait.
+            running = self.scope.average(averages, frame_timeout=2*self.config.getVal('scope_wait'),
+                                         progress=lambda i: prog.Update(i,"Reading trace %d" % (i)),
+                                         method=self.config.getVal('scope_average_method'),
+                                         reject=self.config.getVal('scope_reject_frames'),
+                                         align=self.config.getVal('scope_align'),
+                                         done=done)
+            prog.Destroy()
         else:
             self.show_error("Can't connect to scope PV", "Scope read error")
             return CODES.Error
+        if running.count == 0:
+            self.show_error("No new frames from scope PV", "Scope read error")
+            return CODES.Error
 
-        avg = np.average(np.array(datas),axis=0)  
-        feedback_curve = Curve(curve_array = avg, name = 'Current')
-        feedback_curve.process('clip','norm',bkg=self.background, 
-            crop = cropping , resample = self.num_points)
-        self.current_output = feedback_curve.get_processed()
+        # Keep the per-sample noise of the average for diagnostics
+        self.scope_noise = running.std_error()
+        if done is not None:
+            print(get_message_time()+"Averaged %d scope traces" % (running.count))
+        # Background, crop and resample are all linear, so go straight from the scope
+        # samples to the AWG points with one sparse product
+        if self.crop_at_source:
+            # Frames are already cropped to the pulse window
+            bkg = self.scope_background.get_raw()
+            cropping = None
+        else:
+            bkg = self.background.get_raw()
+            if self.rolling_background is not None:
+                # Follow the baseline with every frame we have
+                self.rolling_background.update(running.frames())
+                bkg = self.rolling_background.estimate(running.mean)
+            cropping = (self.slice_start, self.slice_length)      
+        scope_map = get_linear_map(len(running.mean), cropping, self.num_points,
+                                   self.config.getVal('resample_method'))
+        self.current_output = scope_map.apply(running.mean, bkg=bkg)
         wx.SafeYield(self)
         return CODES.NoError
 
@@ -431,35 +551,189 @@ class LoopFrame(wx.Frame):
     def save_files(self):
         location=self.config.getVal('diag')
         fileroot=datetime.now().strftime("%Y_%m_%d_%Hh%M")
+        awg_spacing = self.config.getVal('awg_ns_per_point')*1e-9
         if self.i == 0:
-            np.savetxt(location + fileroot + '_target.txt', self.target)
-            np.savetxt(location + fileroot + '_background.txt', self.background.get_raw())       
-        np.savetxt((location + fileroot + '_i_%0.5d_AWG_shape.txt' % self.i), self.awg_now)
-        np.savetxt((location + fileroot + '_i_%0.5d_g_%.2f_correction.txt' % (self.i+1,self.gain)), self.correction_factor)
-        np.savetxt((location + fileroot + '_i_%0.5d_scope_trace.txt' % self.i), self.current_output)
+            self.save_diag(location + fileroot + '_target', self.target, awg_spacing)
+            self.save_diag(location + fileroot + '_background', self.background.get_raw(), self.time_res,
+                           self.scope_pv.pvname)       
+        self.save_diag((location + fileroot + '_i_%0.5d_AWG_shape' % self.i), self.awg_now, awg_spacing)
+        self.save_diag((location + fileroot + '_i_%0.5d_g_%.2f_correction' % (self.i+1,self.gain)), self.correction_factor,
+                       awg_spacing)
+        self.save_diag((location + fileroot + '_i_%0.5d_scope_trace' % self.i), self.current_output, awg_spacing,
+                       self.scope_pv.pvname)
+
+
+    def save_diag(self, root, data, spacing, source=None):
+        # Binary files are exact and much quicker to write and read back
+        if self.config.getVal('diag_binary'):
+            curve = Curve(curve_array = np.asarray(data, dtype=float), name = root.split('/')[-1])
+            curve.spacing = spacing
+            curve.source = source
+            curve.timestamp = time.time()
+            curve.save(raw = True, pathname = root + BINARY_SUFFIX)
+        else:
+            np.savetxt(root + '.txt', data)
 
 
     def get_awg_now(self):
-        if self.sim == True:
-            # Assume 1 to 1 mapping of AWG to output for simulation
-            return self.current_output
-        else:
-            # Read from the AWG and extract the number of points used for this pulse
-            return self.awg.get_normalised_shape()[:self.num_points]
+        # Read from the AWG and extract the number of points used for this pulse
+        return self.awg.get_normalised_shape()[:self.num_points]
 
 
     def simulate_start_data(self):
+        # Starting AWG shape for simulation mode
         temp=0.5*np.ones(np.size(self.background.get_raw()))
         temp[250:350]=0.01
         temp[400:500]=0.03
         cropping = (self.slice_start, self.slice_length)
         
         sim_curve = Curve(curve_array = temp)
-        sim_curve.process('clip','norm',bkg=self.background,
+        sim_curve.process('clip','norm',
                 crop = cropping , resample = self.num_points)
         return sim_curve.get_processed()
 
 
+    def live_frames(self):
+        # The most recent frames from the live monitor, if it is streaming this scope
+        monitor = self.live_monitor
+        if self.sim or monitor is None or not monitor.is_running() or monitor.pvname != self.scope_pv.pvname:
+            return []
+        frames = monitor.latest(self.scope_averages)
+        if self.crop_at_source:
+            frames = frames[:, self.slice_start:self.slice_start + self.slice_length]
+        return frames
+
+
+    def enough_averages(self, running):
+        # Stop when the standard error of the mean, over the samples where the target is 
+        # non-zero and relative to the pulse peak (as it will be after normalising), 
+        # is below the set fraction of the current rms error
+        if running.count < 3:
+            return False
+        region = self.target_region
+        if self.rolling_background is not None:
+            bkg = self.rolling_background.estimate(running.mean)[region]
+        else:
+            bkg = self.background.get_raw()[region + (self.slice_start if self.crop_at_source else 0)]
+        peak = np.amax(running.mean[region] - bkg)
+        if peak <= 0:
+            return False
+        noise = np.sqrt(np.mean(running.variance()[region]) / running.count) / peak
+        return noise < self.config.getVal('scope_snr_fraction') * self.rms_error()
+
+
+    def find_target_region(self):
+        # Indices of the acquired frame samples that map onto non-zero target points. The
+        # pulse window is resampled linearly, so window sample w lands on AWG point
+        # w*(num_points-1)/(length-1).
+        w = np.arange(self.slice_length)
+        nearest = np.rint(w * (len(self.target) - 1) / float(max(self.slice_length - 1, 1))).astype(int)
+        region = np.flatnonzero(self.target[nearest] > 0)
+        if len(region) == 0:
+            region = w
+        return region if self.crop_at_source else region + self.slice_start
+
+
+    def start_scope(self):
+        # If configured, only the pulse window is requested from the scope, so the data
+        # sent and the averaging work scale with the window rather than the whole record.
+        # Either a subarray PV is set up to serve the window, or a CA element count is
+        # used to fetch the record up to the end of the window, which is then cropped.
+        self.crop_at_source = self.config.getVal('scope_crop_at_source')
+        if self.crop_at_source and self.config.getVal('bkg_mode') == 'rolling':
+            print(get_message_time()+"Rolling background needs the samples before the pulse, reading the whole scope record")
+            self.crop_at_source = False
+        if not self.crop_at_source:
+            self.scope = ScopeAcquirer(self.scope_pv)
+            return
+
+        start = self.slice_start
+        stop = self.slice_start + self.slice_length
+        subarray = self.config.getVal('scope_subarray_pv').strip()
+        if subarray:
+            self.pv_factory(subarray + ".INDX").put(start, wait=True)
+            self.pv_factory(subarray + ".NELM").put(self.slice_length, wait=True)
+            self.acquisition_pv = self.pv_factory(subarray, auto_monitor=True)
+            crop = None
+        else:
+            self.acquisition_pv = self.pv_factory(self.scope_pv.pvname, count=stop, auto_monitor=True)
+            crop = (start, self.slice_length)
+        self.acquisition_pv.wait_for_connection()
+        self.scope = ScopeAcquirer(self.acquisition_pv, crop=crop)
+        self.scope_background = Curve(curve_array = self.background.get_raw()[start:stop], name = 'Background')
+
+
+    def start_background(self):
+        # With a rolling background the background file only gives the starting template
+        self.rolling_background = None
+        if self.config.getVal('bkg_mode') != 'rolling':
+            return
+        if self.slice_start < 2:
+            print(get_message_time()+"No samples before the pulse for a rolling background, using the background file")
+            return
+        self.rolling_background = RollingBackground(self.background.get_raw(), self.slice_start,
+                                                    weight=self.config.getVal('bkg_rolling_weight'))
+
+
+    def watch_scope_settings(self):
+        # Monitor the scope settings that change what the trace means. The trigger delay
+        # is a scope setting and the vertical scale a channel setting, so their PV names
+        # are made from the scope and channel parts of the scope PV.
+        scope_prefix = self.scope_pv.pvname.split(':')[0]
+        channel_prefix = self.scope_pv.pvname.rsplit(':', 1)[0]
+        pvs = {'time resolution': self.time_resolution_pv}
+        delay_suffix = self.config.getVal('scope_trigger_delay_suffix').strip()
+        scale_suffix = self.config.getVal('scope_scale_suffix').strip()
+        if delay_suffix:
+            pvs['trigger delay'] = self.pv_factory(scope_prefix + delay_suffix)
+        if scale_suffix:
+            pvs['vertical scale'] = self.pv_factory(channel_prefix + scale_suffix)
+        self.scope_settings = SettingsWatcher(pvs)
+
+
+    def rescale_time_base(self, time_res):
+        # The pulse arrives at the same time after the trigger, so move the window to
+        # the same times on the new time base, and resample the background to match
+        scale = self.time_res / time_res
+        old_start, old_length = self.slice_start, self.slice_length
+        self.slice_start = int(round(self.slice_start * scale))
+        self.slice_length = int(self.pulse_length*1e-9/time_res)
+        bkg = self.background.get_raw()
+        samples = np.arange(len(bkg))
+        self.background = Curve(curve_array = np.interp(samples / scale, samples, bkg), name = 'Background')
+        print(get_message_time()+"Scope time resolution changed from %g to %g s. Window moved from %d+%d to %d+%d" % (
+            self.time_res, time_res, old_start, old_length, self.slice_start, self.slice_length))
+        self.time_res = time_res
+
+        # Restart acquisition with the new window
+        self.scope.close()
+        if self.crop_at_source:
+            self.acquisition_pv.disconnect()
+        self.start_scope()
+        self.start_background()
+        self.target_region = self.find_target_region()
+
+
+    def start_sim_ioc(self):
+        # Replace the scope and AWG with the local stand-in IOC, so the rest of the loop
+        # runs exactly as it would with hardware
+        self.sim_ioc = SimIoc(awg_prefix=self.config.getVal('awg_prefix'),
+            scope_pv=self.scope_pv.pvname,
+            background=self.background.get_raw(),
+            resolution=self.pulse_length*1e-9/self.slice_length,
+            pulse_start=self.slice_start,
+            ns_per_point=self.config.getVal('awg_ns_per_point'),
+            num_samples=max(256, self.num_points),
+            initial_shape=self.simulate_start_data(),
+            put_latency=self.config.getVal('sim_put_latency'),
+            busy_time=self.config.getVal('sim_busy_time'),
+            noise=self.config.getVal('sim_noise'),
+            frame_period=self.config.getVal('sim_frame_period'))
+        self.scope_pv = self.sim_ioc.PV(self.scope_pv.pvname)
+        self.time_resolution_pv = self.sim_ioc.PV(self.scope_pv.pvname.split(':')[0] + ":SetResolution")
+        self.pv_factory = self.sim_ioc.PV
+
+
     def import_awg_filter(self):
 
         # null filter to apply if import fails
@@ -0,0 +1,90 @@
+import epics, time
+import numpy as np
+from util import get_message_time
+
+
+class PvPool():
+    '''Holds persistent connections to a set of PVs so that they can be reused for
+        the life of the loop, rather than looking up a channel on every caget/caput'''
+
+    def __init__(self, names=(), timeout=5.0, pv_factory=epics.PV):
+        self.pv_factory = pv_factory
+        self.pvs = {}
+        self._created = {}
+        self.latency = {}
+        if len(names) > 0:
+            self.connect(names, timeout)
+
+
+    def _create(self, name, **kwargs):
+        def on_connect(pvname=None, conn=None, **kws):
+            # Record how long the channel took to connect the first time
+            if conn and name not in self.latency:
+                self.latency[name] = time.time() - self._created[name]
+        self._created[name] = time.time()
+        self.pvs[name] = self.pv_factory(name, connection_callback=on_connect, **kwargs)
+        return self.pvs[name]
+
+
+    def connect(self, names, timeout=5.0):
+        # Create all the channels first so that the searches go out in parallel,
+        # then wait for them with a shared timeout
+        for name in names:
+            if name not in self.pvs:
+                self._create(name)
+        pvs = [self.pvs[name] for name in names]
+        t0 = time.time()
+        for pv in pvs:
+            pv.wait_for_connection(timeout=max(timeout - (time.time() - t0), 0.01))
+        failed = [pv.pvname for pv in pvs if not pv.connected]
+        if len(failed) > 0:
+            print(get_message_time()+"Warning: %d of %d PVs failed to connect, e.g. %s" % (len(failed), len(pvs), failed[0]))
+        return len(failed) == 0
+
+
+    def get_pv(self, name):
+        # Return the pooled PV, adding it to the pool if it isn't there yet
+        if name in self.pvs:
+            return self.pvs[name]
+        pv = self._create(name)
+        pv.wait_for_connection()
+        return pv
+
+
+    def add_monitor(self, name, callback):
+        # Subscribe to value changes. The channel is created with a monitor if it isn't
+        # pooled yet; connect() can then be used to wait for it alongside the others
+        if name not in self.pvs:
+            self._create(name, auto_monitor=True)
+        return self.pvs[name].add_callback(callback)
+
+
+    def get(self, name, **kwargs):
+        return self.get_pv(name).get(**kwargs)
+
+
+    def put(self, name, value, **kwargs):
+        return self.get_pv(name).put(value, **kwargs)
+
+
+    def stats(self):
+        latencies = np.array(list(self.latency.values()))
+        connected = sum(1 for pv in self.pvs.values() if pv.connected)
+        if len(latencies) == 0:
+            latencies = np.zeros(1)
+        return {"count": len(self.pvs),
+                "connected": connected,
+                "mean_latency": float(np.mean(latencies)),
+                "max_latency": float(np.amax(latencies))}
+
+
+    def print_stats(self):
+        s = self.stats()
+        print(get_message_time()+"PV pool: %d of %d connected, latency mean %.1f ms, max %.1f ms" % (
+            s["connected"], s["count"], 1000*s["mean_latency"], 1000*s["max_latency"]))
+
+
+    def close(self):
+        for pv in self.pvs.values():
+            pv.disconnect()
+        self.pvs = {}
@@ -0,0 +1,408 @@
+import queue, threading
+import numpy as np
+from scipy import stats
+from util import get_message_time
+
+AVERAGE_METHODS = ["mean", "median", "trimmed", "sigma_clip"]
+
+
+class ScopeAcquirer():
+    '''
+    Collects frames from the scope waveform PV through a monitor rather than by polling.
+    A frame is only counted if it is new: it must differ from the previous one in both
+    its CA timestamp and its content, so the same shot is never averaged twice.
+    If crop is given as (start, length), only that window of each frame is kept.
+    Frames are only queued while collecting is set, which acquire() and average() do
+    for as long as they run, so nothing builds up between acquisitions.
+    '''
+
+    def __init__(self, pv, crop=None):
+        self.pv = pv
+        self.crop = crop
+        self.frames = queue.Queue()
+        self.collecting = threading.Event()
+        self.last_timestamp = None
+        self.last_hash = None
+        self.cb_index = self.pv.add_callback(self._on_frame)
+
+
+    def _on_frame(self, value=None, timestamp=None, **kws):
+        # Called from the CA thread for every monitor update
+        if value is None:
+            return
+        if not self.collecting.is_set():
+            self.last_timestamp = timestamp
+            return
+        if self.crop is not None:
+            value = value[self.crop[0]:self.crop[0] + self.crop[1]]
+        frame = np.array(value, dtype=float)
+        frame_hash = hash(frame.tobytes())
+        if timestamp == self.last_timestamp or frame_hash == self.last_hash:
+            return
+        self.last_timestamp = timestamp
+        self.last_hash = frame_hash
+        self.frames.put(frame)
+
+
+    def acquire(self, n, frame_timeout=5.0, progress=None):
+        '''
+        Return a list of the next n new frames. Returns early with the frames collected
+        so far if no new frame arrives within frame_timeout seconds. progress, if given,
+        is called with the number of frames collected each time a new one arrives.
+        '''
+        return list(self._new_frames(n, frame_timeout, progress))
+
+
+    def average(self, n, frame_timeout=5.0, progress=None, method="mean", reject=False, align=False,
+                done=None):
+        '''
+        As acquire(), but returns the average of the frames. For a plain mean each frame
+        is folded into a RunningAverage as it arrives rather than being kept, so memory
+        use doesn't grow with n. The robust methods (see robust_average), rejection of
+        bad frames and jitter alignment need the whole stack, and return a StackAverage.
+        Both have the same count, mean, std() and std_error() interface.
+
+        If done is given, it is called with the RunningAverage of the frames so far after
+        each one arrives, and acquisition stops early when it returns True. n is then
+        the maximum number of frames.
+        '''
+        keep_stack = method != "mean" or reject or align
+        frames = []
+        avg = RunningAverage()
+        for frame in self._new_frames(n, frame_timeout, progress):
+            avg.add(frame)
+            if keep_stack:
+                frames.append(frame)
+            if done is not None and done(avg):
+                break
+        if keep_stack:
+            return StackAverage(frames, method, reject, align)
+        return avg
+
+
+    def _new_frames(self, n, frame_timeout, progress):
+        # Only frames that arrive after the request count
+        while not self.frames.empty():
+            self.frames.get_nowait()
+
+        self.collecting.set()
+        try:
+            i = 0
+            while i < n:
+                try:
+                    frame = self.frames.get(timeout=frame_timeout)
+                except queue.Empty:
+                    print(get_message_time()+"No new scope frame in %.1f s, got %d of %d" % (frame_timeout, i, n))
+                    return
+                i += 1
+                yield frame
+                if progress:
+                    progress(i)
+        finally:
+            self.collecting.clear()
+
+
+    def close(self):
+        self.pv.remove_callback(self.cb_index)
+
+
+
+class SettingsWatcher():
+    '''
+    Watches scope settings that affect the acquired trace, such as the time base, through
+    monitors, so a change is flagged as soon as it happens rather than found by polling.
+    pvs is a dict of {setting name: PV}. changes() returns {name: new value} for every
+    setting that differs from the value accepted last, initially the value at start, or
+    the first value seen for a PV that wasn't connected at start.
+    '''
+
+    def __init__(self, pvs):
+        self.pvs = pvs
+        self.lock = threading.Lock()
+        # Don't wait on PVs that aren't connected, their first monitor sets the reference
+        self.values = dict((name, pv.get() if pv.connected else None) for name, pv in pvs.items())
+        self.pending = {}
+        self.cb_index = {}
+        for name, pv in pvs.items():
+            self.cb_index[name] = pv.add_callback(self._on_change, setting=name)
+
+
+    def _on_change(self, value=None, setting=None, **kws):
+        with self.lock:
+            if self.values[setting] is None:
+                self.values[setting] = value
+            elif value == self.values[setting]:
+                self.pending.pop(setting, None)
+            else:
+                self.pending[setting] = value
+                print(get_message_time()+"Scope %s changed to %s" % (setting, value))
+
+
+    def changes(self):
+        with self.lock:
+            return dict(self.pending)
+
+
+    def accept(self):
+        # Take the changed values as the new reference
+        with self.lock:
+            self.values.update(self.pending)
+            self.pending = {}
+
+
+    def close(self):
+        for name, pv in self.pvs.items():
+            pv.remove_callback(self.cb_index[name])
+
+
+
+class RollingBackground():
+    '''
+    Background estimated from the scope frames themselves rather than a fixed file. The
+    samples before the pulse window, [0, pre_pulse), only see the background, so each
+    frame gives a baseline offset from them, and they update a slowly varying template
+    by an exponentially weighted average with the given weight. The background is the
+    template plus the frame's offset. Under the pulse the template keeps its starting
+    shape, normally the background file, so only drifts of the baseline are followed there.
+    Frames can be a single frame or a stack, shape (frames, samples).
+    '''
+
+    def __init__(self, template, pre_pulse, weight=0.05):
+        self.pre = slice(0, pre_pulse)
+        self.weight = weight
+        # The offsets carry the level, so the template is kept at zero mean before the pulse
+        self.template = np.array(template, dtype=float)
+        self.template -= np.mean(self.template[self.pre])
+
+
+    def offsets(self, frames):
+        frames = np.atleast_2d(frames)
+        return np.mean(frames[:, self.pre] - self.template[self.pre], axis=1)
+
+
+    def update(self, frames):
+        # Fold the pre-pulse shape of the frames, less their offsets, into the template
+        frames = np.atleast_2d(frames)
+        offsets = self.offsets(frames)
+        shape = np.mean(frames[:, self.pre] - offsets[:, np.newaxis], axis=0)
+        self.template[self.pre] += self.weight * (shape - self.template[self.pre])
+        return offsets
+
+
+    def estimate(self, frames):
+        background = self.template + self.offsets(frames)[:, np.newaxis]
+        return background[0] if np.ndim(frames) == 1 else background
+
+
+
+class RunningAverage():
+    '''
+    Streaming mean and variance of a sequence of equal length frames (Welford's method).
+    The buffers are allocated with the first frame and updated in place, so the mean is
+    ready as soon as the last frame is added.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+
+    def add(self, frame):
+        if self.mean is None:
+            self.mean = np.zeros(len(frame))
+            self._m2 = np.zeros(len(frame))
+            self._delta = np.empty(len(frame))
+            self._scratch = np.empty(len(frame))
+        self.count += 1
+        np.subtract(frame, self.mean, out=self._delta)
+        np.divide(self._delta, self.count, out=self._scratch)
+        self.mean += self._scratch
+        np.subtract(frame, self.mean, out=self._scratch)
+        self._scratch *= self._delta
+        self._m2 += self._scratch
+
+
+    def variance(self):
+        # Per-sample variance of the frames
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self._m2 / (self.count - 1)
+
+
+    def std(self):
+        # Per-sample noise of a single frame
+        return np.sqrt(self.variance())
+
+
+    def std_error(self):
+        # Per-sample noise of the mean
+        if self.count == 0:
+            return self.std()
+        return np.sqrt(self.variance() / self.count)
+
+
+    def frames(self):
+        # The individual frames aren't kept, so the mean stands in for them
+        return self.mean[np.newaxis]
+
+
+
+class StackAverage():
+    '''
+    Average of a stack of frames using one of AVERAGE_METHODS, optionally aligning the
+    frames to remove trigger jitter and rejecting bad frames first. Has the same 
+    interface as RunningAverage.
+    '''
+
+    def __init__(self, frames, method="mean", reject=False, align=False):
+        stack = np.array(frames, dtype=float)
+        self.rejected = []
+        self.shifts = np.zeros(len(stack))
+        if align and len(stack) > 1:
+            stack, self.shifts = align_frames(stack)
+            print(get_message_time()+"Shot jitter: rms %.2f samples, shifts %s" % (
+                np.sqrt(np.mean(self.shifts**2)), np.round(self.shifts, 2).tolist()))
+        if reject and len(stack) > 2:
+            keep = reject_frames(stack)
+            self.rejected = np.flatnonzero(~keep).tolist()
+            stack = stack[keep]
+        self.stack = stack
+        self.count = len(stack)
+        self.mean = robust_average(stack, method) if self.count > 0 else None
+
+    def variance(self):
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return np.var(self.stack, axis=0, ddof=1)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def std_error(self):
+        if self.count == 0:
+            return self.std()
+        return np.sqrt(self.variance() / self.count)
+
+    def frames(self):
+        return self.stack
+
+
+
+def robust_average(stack, method="mean", trim=0.1, sigma=3.0, iterations=3):
+    '''
+    Average a stack of frames, shape (frames, samples), over the frames.
+
+    method:
+        "mean": plain mean
+        "median": per-sample median
+        "trimmed": per-sample mean after dropping the highest and lowest trim fraction
+        "sigma_clip": per-sample mean after iteratively ignoring values more than sigma
+            standard deviations from the mean
+    '''
+    stack = np.asarray(stack, dtype=float)
+    if method == "median":
+        return np.median(stack, axis=0)
+    elif method == "trimmed":
+        return stats.trim_mean(stack, trim, axis=0)
+    elif method == "sigma_clip":
+        keep = np.ones(stack.shape, dtype=bool)
+        for i in range(iterations):
+            n = np.maximum(keep.sum(axis=0), 1)
+            mean = np.where(keep, stack, 0).sum(axis=0) / n
+            std = np.sqrt(np.where(keep, (stack - mean)**2, 0).sum(axis=0) / n)
+            new_keep = np.abs(stack - mean) <= sigma * std
+            if np.array_equal(new_keep, keep):
+                break
+            keep = new_keep
+        n = np.maximum(keep.sum(axis=0), 1)
+        return np.where(keep, stack, 0).sum(axis=0) / n
+    else:
+        if method != "mean":
+            print("Unrecognised averaging method: %s. Using mean" % method)
+        return np.mean(stack, axis=0)
+
+
+
+def reject_frames(stack, energy_sigma=4.0, min_correlation=0.9):
+    '''
+    Find misfired or clipped shots in a stack of frames. A frame is rejected if its total
+    energy is more than energy_sigma robust standard deviations from the median, or if
+    its correlation with the mean of all the frames that pass the energy test (itself
+    included) is below min_correlation.
+    Returns a boolean array, True for frames to keep.
+    '''
+    energy = stack.sum(axis=1)
+    median = np.median(energy)
+    spread = 1.4826 * np.median(np.abs(energy - median))
+    if spread > 0:
+        keep = np.abs(energy - median) <= energy_sigma * spread
+    else:
+        keep = np.ones(len(stack), dtype=bool)
+
+    # Pearson correlation of every frame with the reference in one go
+    reference = stack[keep].mean(axis=0)
+    centred = stack - stack.mean(axis=1, keepdims=True)
+    ref_centred = reference - reference.mean()
+    norms = np.linalg.norm(centred, axis=1) * np.linalg.norm(ref_centred)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = np.where(norms > 0, centred.dot(ref_centred) / norms, 1.0)
+    keep = np.logical_and(keep, correlation >= min_correlation)
+
+    if not np.any(keep):
+        print(get_message_time()+"All frames would be rejected, keeping them all")
+        return np.ones(len(stack), dtype=bool)
+    for i in np.flatnonzero(~keep):
+        print(get_message_time()+"Rejected shot %d: energy %.3g (median %.3g), correlation %.3f" % (
+            i, energy[i], median, correlation[i]))
+    return keep
+
+
+
+def align_frames(stack, reference=None, max_shift=None):
+    '''
+    Register every frame in a stack, shape (frames, samples), to a reference using FFT
+    cross-correlation, with parabolic interpolation of the peak for sub-sample accuracy.
+    The whole stack is transformed in one batch. If no reference is given, every frame
+    is correlated against the mean of the whole stack, not against any one frame.
+    Shifts are limited to max_shift samples (default a quarter of the frame).
+
+    Returns the aligned stack and the measured shift of each frame in samples, positive
+    if the frame arrived late.
+    '''
+    stack = np.asarray(stack, dtype=float)
+    n = stack.shape[1]
+    if reference is None:
+        reference = stack.mean(axis=0)
+    if max_shift is None:
+        max_shift = n // 4
+    # Zero pad so the correlation is linear rather than circular
+    nfft = int(2**np.ceil(np.log2(2*n)))
+
+    # Correlate with the offsets removed, so the baseline doesn't dominate the peak
+    spectra = np.fft.rfft(stack - stack.mean(axis=1, keepdims=True), nfft, axis=1)
+    ref_spectrum = np.fft.rfft(reference - reference.mean(), nfft)
+    correlation = np.fft.irfft(spectra * np.conj(ref_spectrum), nfft, axis=1)
+
+    # Only search lags within +/- max_shift
+    lags = np.concatenate((np.arange(0, max_shift + 1), np.arange(-max_shift, 0)))
+    window = correlation[:, lags]
+    peak = np.argmax(window, axis=1)
+    rows = np.arange(len(stack))
+    before = window[rows, (peak - 1) % len(lags)]
+    at = window[rows, peak]
+    after = window[rows, (peak + 1) % len(lags)]
+    denominator = before - 2*at + after
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(denominator != 0, 0.5 * (before - after) / denominator, 0)
+    shifts = lags[peak] + np.clip(fraction, -0.5, 0.5)
+
+    # Move each frame back by its shift with a phase ramp. Pad with the edge values
+    # rather than zeros so that what shifts in at either end continues the baseline.
+    pad = nfft - n
+    padded = np.concatenate((stack, np.repeat(stack[:, -1:], pad // 2, axis=1),
+                             np.repeat(stack[:, :1], pad - pad // 2, axis=1)), axis=1)
+    k = np.arange(nfft // 2 + 1)
+    ramp = np.exp(2j * np.pi * np.outer(shifts, k) / nfft)
+    aligned = np.fft.irfft(np.fft.rfft(padded, axis=1) * ramp, nfft, axis=1)[:, :n]
+    return aligned, shifts
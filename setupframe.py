@@ -4,8 +4,11 @@ from fileEditor import FileEditDialog
 from curve import Curve, BkgCurve, TargetCurve
 import numpy as np
 import wx, time, os, sys
-from util import CODES
+from util import CODES, get_message_time
 from loopframe import LoopFrame 
+from scope import ScopeAcquirer
+from livemonitor import LiveMonitor
+from liveframe import LiveFrame
 
 if sys.version_info[0] < 3:
     import ConfigParser as cp
@@ -68,6 +71,7 @@ class SetupFrame(wx.Frame):
         # Event bindings
         self.Bind(wx.EVT_MENU, self.onConfig, self.configMenuItem)
         self.Bind(wx.EVT_MENU, self.onFilter, self.filterMenuItem)
+        self.Bind(wx.EVT_MENU, self.on_live, self.liveMenuItem)
         self.Bind(wx.EVT_BUTTON, self.on_browse, self.bkg_browse_button)
         self.Bind(wx.EVT_BUTTON, self.on_preview, self.bkg_preview_button)
         self.Bind(wx.EVT_BUTTON, self.on_browse, self.target_browse_button)
@@ -90,13 +94,15 @@ class SetupFrame(wx.Frame):
         self.background_curve = BkgCurve(name = 'Background')
         self.target_curve = TargetCurve(name = 'Target')
         self.scope_curve = Curve(name = 'Scope') # Used to hold data from a 'grab'
+        self.live_monitor = None
+        self.live_frame = None
 
         # Load old parameters
         self.load_state()
         
         # Create scope pvs and connect
         self.scope_pv_name = self.scope_pv_text_ctrl.GetValue().strip()
-        self.scope_pv = epics.PV(self.scope_pv_name, connection_callback=self.on_pv_connect)
+        self.scope_pv = epics.PV(self.scope_pv_name, connection_callback=self.on_pv_connect, auto_monitor=True)
         if self.scope_pv.connected:
             self.scope_pv_text_ctrl.SetBackgroundColour('#0aff05')
         else:
@@ -208,7 +214,7 @@ class SetupFrame(wx.Frame):
     def on_scope_pv(self,event): 
         """ Connects to pv when user hits enter. Uses PyEpics. """
         self.scope_pv_name = self.scope_pv_text_ctrl.GetValue().strip()
-        self.scope_pv = epics.PV(self.scope_pv_name, connection_callback=self.on_pv_connect)
+        self.scope_pv = epics.PV(self.scope_pv_name, connection_callback=self.on_pv_connect, auto_monitor=True)
         #Change the colour after connection attempt, and set the on/off pv
         if self.scope_pv.connected:
             self.scope_pv_text_ctrl.SetBackgroundColour('#0aff05')
@@ -230,6 +236,8 @@ class SetupFrame(wx.Frame):
 
 
     def closeWindow(self, event):
+        if self.live_frame is not None:
+            self.live_frame.Close()
         self.save_state()
         self.config.Destroy()
         self.Destroy()
@@ -276,30 +284,77 @@ class SetupFrame(wx.Frame):
     def on_grab_trace(self, event): 
         ''' Grabs a user defined number of traces from the scope'''
         num_to_average = int(self.trc_avg.GetValue())
-        datas=[]
-        i=0
         self.on_scope_pv(event)
         if self.scope_pv.connected:
             prog = wx.ProgressDialog("Getting scope data", "Reading trace 1", num_to_average)
-            while i < num_to_average:
-                data = self.scope_pv.get()
-                datas.append(data)
-                time.sleep(self.config.getVal('scope_wait'))
-                i+=1
-                prog.Update(i,"Reading trace %d" % (i))                                   
+            scope = ScopeAcquirer(self.scope_pv)
+            running = scope.average(num_to_average, frame_timeout=2*self.config.getVal('scope_wait'),
+                                    progress=lambda i: prog.Update(i,"Reading trace %d" % (i)),
+                                    method=self.config.getVal('scope_average_method'),
+                                    reject=self.config.getVal('scope_reject_frames'),
+                                    align=self.config.getVal('scope_align'))
+            scope.close()
+            prog.Destroy()
         else:
             self.show_error("Can't connect to scope PV", "Scope read error")
             return
 
         try:
-            result = np.average(np.array(datas),axis=0)
+            result = running.mean.copy()
             self.scope_curve = Curve(curve_array = result, name = 'Scope')
+            # Kept in the header if the trace is saved as a binary file
+            self.scope_curve.source = self.scope_pv_name
+            self.scope_curve.timestamp = time.time()
+            if self.time_resolution_pv.connected:
+                self.scope_curve.spacing = self.time_resolution_pv.get()
         except:
             caption = """Scope may not be sending data.
             Check correct PV is connected and that the scope IOC is running"""
             self.show_error(caption, "Error when averaging scope data")
 
 
+    def on_live(self, event):
+        ''' Streams the scope into a shared buffer and shows the live shape against the target'''
+        if self.live_frame is not None:
+            self.live_frame.Raise()
+            return
+        try:
+            num_points = int(float(self.plength_text_ctrl.GetValue())/self.config.getVal('awg_ns_per_point'))
+            start = int(self.scope_start_text_ctrl.GetValue())
+            length = int(self.scope_length_text_control.GetValue())
+            averages = int(self.trc_avg.GetValue())
+        except:
+            self.show_error("Check parameters are all valid numbers", "Value error")
+            return
+        if self.load('bkg') != CODES.NoError:
+            self.show_error("Can't load background curve", "File error")
+            return
+        target_loaded = self.load('tgt_file') if self.tgt_src_cb.GetSelection() == 1 else self.load('library')
+        if target_loaded != CODES.NoError:
+            self.show_error("Can't load target curve", "File error")
+            return
+        if not self.scope_pv.connected:
+            self.show_error("Can't connect to scope PV", "Scope read error")
+            return
+        frame_length = np.size(self.scope_pv.get())
+        if frame_length != np.size(self.background_curve.get_raw()):
+            self.show_error("Scope trace and background have different lengths", "Live monitor")
+            return
+
+        self.live_monitor = LiveMonitor(self.scope_pv_name, frame_length,
+                                        capacity=self.config.getVal('live_buffer_frames'))
+        self.live_frame = LiveFrame(self, self.live_monitor, self.target_curve.get_processed(),
+                                    self.background_curve, (start, length), num_points, averages,
+                                    self.config.getVal('awg_ns_per_point'), self.config.getVal('resample_method'))
+
+
+    def on_live_closed(self):
+        # Called by the live window as it closes
+        self.live_frame = None
+        self.live_monitor.stop()
+        self.live_monitor = None
+
+
     def on_trace_save(self, event):  
         self.scope_curve.save(raw = True)
 
@@ -312,6 +367,11 @@ class SetupFrame(wx.Frame):
 
         # Reload curves
         bkg_loaded = self.load('bkg')
+        if bkg_loaded != CODES.NoError and self.config.getVal('bkg_mode') == 'rolling' and self.scope_pv.connected:
+            # The background is estimated from the frames, so the file is optional
+            print(get_message_time()+"No background file, the rolling background will start from zero")
+            self.background_curve = BkgCurve(curve_array = np.zeros(np.size(self.scope_pv.get())), name = 'Background')
+            bkg_loaded = CODES.NoError
         if bkg_loaded != CODES.NoError:
             self.show_error("Can't load background curve", "File error")
             return
@@ -401,6 +461,7 @@ class SetupFrame(wx.Frame):
         self.config.setVal('start', start)
         self.config.setVal('averages', averages)
         self.config.setVal('length', length)
+        self.config.setVal('live_monitor', self.live_monitor)
         
         self.loop = LoopFrame(self, self.config)
 
@@ -619,6 +680,7 @@ class SetupFrame(wx.Frame):
         settingsMenu = wx.Menu()
         self.configMenuItem = settingsMenu.Append(wx.NewId(), "Configure", "Edit configuration")
         self.filterMenuItem = settingsMenu.Append(wx.NewId(), "Edit filter", "Open filter file for editing")
+        self.liveMenuItem = settingsMenu.Append(wx.NewId(), "Live monitor", "Show the live pulse shape against the target")
         menuBar.Append(settingsMenu, "&Settings")
         
         self.SetMenuBar(menuBar)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+#
+# In-process stand-in for the AWG and scope IOCs. It serves the AWG:* records used in
+# awg.py plus a scope waveform PV and its :SetResolution PV, so the real Awg and
+# LoopFrame code paths can run with no hardware. Run this file directly to benchmark
+# the AWG write methods against it.
+#
+#########################################################################################
+import re, time, threading, itertools, heapq
+import numpy as np
+
+
+class SimPV():
+    '''Implements the subset of epics.PV used by this program, backed by a SimIoc'''
+
+    def __init__(self, ioc, pvname, connection_callback=None, auto_monitor=None, count=None, **kwargs):
+        self.ioc = ioc
+        self.pvname = pvname
+        self.auto_monitor = auto_monitor
+        self.count = count
+        self.connected = True
+        self.put_complete = True
+        self.callbacks = {}
+        self._index = itertools.count()
+        ioc.attach(self)
+        if connection_callback:
+            connection_callback(pvname=pvname, conn=True, pv=self)
+
+    @property
+    def value(self):
+        return self.get()
+
+    @property
+    def timestamp(self):
+        return self.ioc.timestamps.get(self.pvname, 0)
+
+    def get(self, count=None, use_monitor=True, timeout=None, **kwargs):
+        # Like a CA get on the same connection, this sees every put sent before it
+        self.ioc.sync()
+        return self._truncate(self.ioc.read(self.pvname), count)
+
+    def _truncate(self, value, count=None):
+        # Only return the requested number of elements, as a CA element count would
+        count = count or self.count
+        if count is not None and np.ndim(value) > 0:
+            value = value[:count]
+        return value
+
+    def put(self, value, wait=False, timeout=30.0, use_complete=False, callback=None, callback_data=None):
+        self.put_complete = False
+        done = threading.Event()
+        def complete():
+            self.ioc.write(self.pvname, value)
+            self.put_complete = True
+            if callback:
+                callback(pvname=self.pvname, data=callback_data)
+            done.set()
+        self.ioc.put(complete)
+        if wait and not done.wait(timeout):
+            return -1
+        return 1
+
+    def add_callback(self, callback, **kwargs):
+        # Extra keywords are passed on to the callback, as pyepics does
+        index = next(self._index)
+        self.callbacks[index] = (callback, kwargs)
+        return index
+
+    def remove_callback(self, index):
+        self.callbacks.pop(index, None)
+
+    def wait_for_connection(self, timeout=None):
+        return self.connected
+
+    def disconnect(self):
+        self.ioc.detach(self)
+        self.connected = False
+
+    def post(self, value, timestamp):
+        value = self._truncate(value)
+        for callback, kwargs in list(self.callbacks.values()):
+            callback(pvname=self.pvname, value=value, timestamp=timestamp, pv=self, **kwargs)
+
+
+class SimIoc():
+    '''
+    Simulates the AWG and scope. The scope output is the current AWG shape mapped onto
+    the scope time base, plus the background and some gaussian noise.
+        put_latency: time (s) taken for every put to complete. Puts complete in the order
+            they're sent, and a get waits for the puts sent before it, as over CA
+        busy_time: time (s) the AWG reports SetWaveformBusy after SetWaveform.PROC
+        noise: standard deviation of the scope noise, relative to the AWG full scale
+        frame_period: time (s) between scope frames, i.e. the laser rep rate
+        drop_rate: fraction of point writes that are silently lost
+    '''
+
+    def __init__(self, awg_prefix="AWG", scope_pv="SIM:CH1:ReadWaveform", background=np.zeros(1000),
+                 resolution=1e-10, pulse_start=300, ns_per_point=0.125, num_samples=256, dac=4095,
+                 initial_shape=None, put_latency=0.02, busy_time=0.5, noise=0.01, frame_period=0.1,
+                 drop_rate=0.0):
+        self.awg_prefix = awg_prefix
+        self.scope_pv = scope_pv
+        self.background = np.asarray(background, dtype=float)
+        self.resolution = resolution
+        self.pulse_start = pulse_start
+        self.ns_per_point = ns_per_point
+        self.dac = dac
+        self.put_latency = put_latency
+        self.busy_time = busy_time
+        self.noise = noise
+        self.frame_period = frame_period
+        self.drop_rate = drop_rate
+
+        self.awg = np.zeros(num_samples, dtype=int)
+        if initial_shape is not None:
+            self.awg[:len(initial_shape)] = np.clip(np.asarray(initial_shape) * dac, 0, dac).astype(int)
+        self.hold = np.zeros(num_samples)
+
+        self.lock = threading.RLock()
+        self.pvs = []
+        self.values = {}
+        self.timestamps = {}
+        self.values[awg_prefix + ":DAC"] = dac
+        self.values[awg_prefix + ":SetWaveformBusy"] = 0
+        self.values[awg_prefix + ":_SelScanDisable"] = 0
+        self.values[awg_prefix + ":ReadWaveform_ascii_do"] = self.awg.copy()
+        self.resolution_pv = scope_pv.split(':')[0] + ":SetResolution"
+        self.values[self.resolution_pv] = resolution
+        self.values[scope_pv] = self.scope_frame()
+        self.puts = 0
+
+        # Puts and other IOC processing are run in time order on one worker thread
+        self.cond = threading.Condition()
+        self.queue = []
+        self.seq = itertools.count(1)
+        self.last_put = 0
+        self.done_put = 0
+
+        self.running = True
+        self.worker = threading.Thread(target=self._run_worker)
+        self.worker.daemon = True
+        self.worker.start()
+        self.scope_thread = threading.Thread(target=self._run_scope)
+        self.scope_thread.daemon = True
+        self.scope_thread.start()
+
+
+    def PV(self, pvname, **kwargs):
+        # Factory with the same call signature as epics.PV
+        return SimPV(self, pvname, **kwargs)
+
+
+    def attach(self, pv):
+        with self.lock:
+            self.pvs.append(pv)
+
+
+    def detach(self, pv):
+        with self.lock:
+            if pv in self.pvs:
+                self.pvs.remove(pv)
+
+
+    def schedule(self, delay, func, is_put=False):
+        # Run asynchronously on the worker, as Channel Access callbacks would be
+        with self.cond:
+            seq = next(self.seq)
+            if is_put:
+                self.last_put = seq
+            heapq.heappush(self.queue, (time.time() + delay, seq, is_put, func))
+            self.cond.notify_all()
+
+
+    def put(self, func):
+        # The IOC handles the requests on a connection in order, so puts complete in the
+        # order they're sent, each put_latency after it was sent
+        self.schedule(self.put_latency, func, is_put=True)
+
+
+    def sync(self):
+        # Wait until every put sent so far has completed
+        if threading.current_thread() is self.worker:
+            return
+        with self.cond:
+            target = self.last_put
+            self.cond.wait_for(lambda: self.done_put >= target or not self.running)
+
+
+    def _run_worker(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.queue or self.queue[0][0] > time.time()):
+                    self.cond.wait(self.queue[0][0] - time.time() if self.queue else None)
+                if not self.running:
+                    return
+                due, seq, is_put, func = heapq.heappop(self.queue)
+            func()
+            if is_put:
+                with self.cond:
+                    self.done_put = seq
+                    self.cond.notify_all()
+
+
+    def read(self, pvname):
+        with self.lock:
+            value = self.values.get(pvname)
+        if isinstance(value, np.ndarray):
+            return value.copy()
+        return value
+
+
+    def post(self, pvname, value):
+        # Update a record and send monitors to anyone subscribed
+        with self.lock:
+            self.values[pvname] = value
+            self.timestamps[pvname] = time.time()
+            timestamp = self.timestamps[pvname]
+            pvs = [pv for pv in self.pvs if pv.pvname == pvname]
+        for pv in pvs:
+            pv.post(value, timestamp)
+
+
+    def write(self, pvname, value):
+        p = self.awg_prefix
+        with self.lock:
+            self.puts += 1
+        point = re.match(re.escape(p) + r":_SetSample(\d+)_do$", pvname)
+        hold = re.match(re.escape(p) + r":HoldSampleNorm(\d+)$", pvname)
+        if point and np.random.random() < self.drop_rate:
+            return
+        elif point:
+            with self.lock:
+                self.awg[int(point.group(1))] = int(np.clip(value, 0, self.dac))
+        elif hold:
+            with self.lock:
+                self.hold[int(hold.group(1))] = value
+        elif pvname == p + ":SetWaveform.PROC":
+            self.post(p + ":SetWaveformBusy", 1)
+            self.schedule(self.busy_time, self._load_waveform)
+        elif pvname == p + ":ReadWaveform_ascii_do.PROC":
+            with self.lock:
+                shape = self.awg.copy()
+            self.post(p + ":ReadWaveform_ascii_do", shape)
+        elif pvname == self.resolution_pv:
+            # The pulse stays at the same time after the trigger, so moves in samples
+            with self.lock:
+                self.pulse_start = self.pulse_start * self.resolution / value
+                self.resolution = value
+            self.post(pvname, value)
+        else:
+            self.post(pvname, value)
+
+
+    def _load_waveform(self):
+        with self.lock:
+            self.awg = np.clip(self.hold * self.dac, 0, self.dac).astype(int)
+        self.post(self.awg_prefix + ":SetWaveformBusy", 0)
+
+
+    def scope_frame(self):
+        # Map each scope sample onto the AWG sample playing at that time
+        t = (np.arange(len(self.background)) - self.pulse_start) * self.resolution
+        index = t / (self.ns_per_point * 1e-9)
+        with self.lock:
+            shape = self.awg / float(self.dac)
+        frame = np.interp(index, np.arange(len(shape)), shape, left=0, right=0)
+        return frame + self.background + np.random.normal(0, self.noise, len(frame))
+
+
+    def _run_scope(self):
+        while self.running:
+            self.post(self.scope_pv, self.scope_frame())
+            time.sleep(self.frame_period)
+
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+
+
+if __name__ == "__main__":
+    import wx
+    from configuration import Configuration
+    from awg import Awg
+
+    app = wx.App()
+    config = Configuration(None)
+    num_points = 82
+    ioc = SimIoc(put_latency=config.getVal('sim_put_latency'), busy_time=config.getVal('sim_busy_time'),
+                 noise=config.getVal('sim_noise'), frame_period=config.getVal('sim_frame_period'))
+
+    # Write the same sequence of shapes with each method and time it
+    shapes = [0.5 + 0.4 * np.sin(np.linspace(0, np.pi, num_points) * k) for k in (1, 2, 3)]
+    for method in ('pts', 'wfm', 'bulk'):
+        config.setVal('awg_write_method', method)
+        awg = Awg(config, num_points, 100, pv_factory=ioc.PV)
+        t0 = time.time()
+        puts = ioc.puts
+        for shape in shapes:
+            awg.get_raw_shape()
+            awg.write(shape, zero_to_end=True)
+        error = np.amax(np.abs(awg.get_normalised_shape(use_cache=False)[:num_points] - shapes[-1]))
+        print("%s: %.2f s for %d writes, %d puts, max error %.4f" % (
+            method, time.time() - t0, len(shapes), ioc.puts - puts, error))
+        awg.close()
+    ioc.stop()
@@ -1,9 +1,14 @@
 from datetime import datetime    
+import wx
 
 # Provides a date and time string for messages printed to the console
 def get_message_time():
     return datetime.now().strftime("%b_%d_%H:%M.%S")+": "
 
+# Ways of resampling a scope trace onto the AWG points, see Curve.process. Kept here
+# rather than in curve so the configuration can list them without loading pyplot.
+RESAMPLE_METHODS = ["interp", "block"]
+
 # Holds utility constants
 class CODES():
     Proceed = 1 
@@ -20,4 +25,5 @@ class RedirectText(object):
         self.out=aWxTextCtrl
  
     def write(self,string):
-        self.out.WriteText(string)
+        # CallAfter so that writes from worker threads are safe
+        wx.CallAfter(self.out.WriteText, string)